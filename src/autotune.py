@@ -0,0 +1,142 @@
+"""
+SLO-driven autotuner for batch size, batching window and torch threads.
+
+A Poisson arrival trace at --rate requests/sec is built from dev utterances,
+so request lengths follow the real distribution. Each configuration is
+replayed through a single-server dynamic batcher: a batch is dispatched when
+it reaches batch_size or when the oldest queued request has waited
+window_ms. Service times come from actually running the prediction path
+(tokenize, forward, decode) on each batch; queueing is simulated on a
+virtual clock, so a trace replays as fast as the model runs. The chosen
+configuration has the highest capacity (requests per busy second) among
+those whose p95 latency meets the SLO.
+"""
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from predict import decode_logits, predict_logits, spans_to_entities
+
+
+def build_trace(texts, rate, num_requests, seed):
+    rng = random.Random(seed)
+    t = 0.0
+    trace = []
+    for _ in range(num_requests):
+        t += rng.expovariate(rate)
+        trace.append((t, rng.choice(texts)))
+    return trace
+
+
+def serve_batch(model, tokenizer, texts, max_length, device):
+    start = time.perf_counter()
+    for text, (offsets, logits) in zip(texts, predict_logits(model, tokenizer, texts, max_length, device)):
+        spans_to_entities(text, decode_logits(text, offsets, logits))
+    return time.perf_counter() - start
+
+
+def replay(model, tokenizer, trace, batch_size, window, max_length, device):
+    """Return (per-request latencies in seconds, total busy seconds)"""
+    latencies = []
+    busy = 0.0
+    server_free = 0.0
+    i = 0
+    while i < len(trace):
+        first_arrival = trace[i][0]
+        # Dispatch when the batch is full or the oldest request has waited `window`
+        deadline = max(first_arrival + window, server_free)
+        j = i + 1
+        while j < len(trace) and j - i < batch_size and trace[j][0] <= deadline:
+            j += 1
+        dispatch = deadline if j - i < batch_size else max(trace[j - 1][0], server_free)
+        service = serve_batch(model, tokenizer, [text for _, text in trace[i:j]], max_length, device)
+        busy += service
+        done = dispatch + service
+        latencies.extend(done - arrival for arrival, _ in trace[i:j])
+        server_free = done
+        i = j
+    return latencies, busy
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, int(q * len(ordered)) - 1)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--model_name", default=None)
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--rate", type=float, default=100.0, help="Target arrival rate (requests/sec)")
+    ap.add_argument("--requests", type=int, default=500, help="Requests per replayed trace")
+    ap.add_argument("--slo_ms", type=float, default=20.0, help="p95 latency budget per utterance")
+    ap.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    ap.add_argument("--windows_ms", nargs="+", type=float, default=[0.0, 2.0, 5.0, 10.0])
+    ap.add_argument("--threads", nargs="+", type=int, default=None, help="Default: powers of two up to cpu_count")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default="out/serving_config.json")
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
+    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
+    model.to(args.device)
+    model.eval()
+
+    texts = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            texts.append(json.loads(line)["text"])
+    trace = build_trace(texts, args.rate, args.requests, args.seed)
+
+    threads = args.threads
+    if threads is None:
+        threads = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= (os.cpu_count() or 1)]
+
+    results = []
+    print(f"{'threads':>7s} {'batch':>5s} {'window':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'capacity rps':>13s}")
+    for num_threads, batch_size, window_ms in itertools.product(threads, args.batch_sizes, args.windows_ms):
+        torch.set_num_threads(num_threads)
+        serve_batch(model, tokenizer, texts[:batch_size], args.max_length, args.device)  # warmup
+        latencies, busy = replay(model, tokenizer, trace, batch_size, window_ms / 1000.0, args.max_length, args.device)
+        r = {
+            "num_threads": num_threads,
+            "batch_size": batch_size,
+            "batch_window_ms": window_ms,
+            "p50_ms": percentile(latencies, 0.5) * 1000.0,
+            "p95_ms": percentile(latencies, 0.95) * 1000.0,
+            "capacity_rps": len(trace) / max(busy, 1e-9),
+        }
+        results.append(r)
+        print(
+            f"{num_threads:7d} {batch_size:5d} {window_ms:7.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} "
+            f"{r['capacity_rps']:13.1f}{'' if r['p95_ms'] <= args.slo_ms else '  (misses SLO)'}"
+        )
+
+    feasible = [r for r in results if r["p95_ms"] <= args.slo_ms]
+    if not feasible:
+        print(f"\nNo configuration meets p95 <= {args.slo_ms} ms at {args.rate} req/s")
+        return
+    best = max(feasible, key=lambda r: (r["capacity_rps"], -r["p95_ms"]))
+    config = dict(best, target_rps=args.rate, slo_ms=args.slo_ms, max_length=args.max_length)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    print(
+        f"\nChosen: threads={best['num_threads']} batch_size={best['batch_size']} "
+        f"window={best['batch_window_ms']}ms  p95={best['p95_ms']:.2f}ms  capacity={best['capacity_rps']:.1f} req/s"
+    )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
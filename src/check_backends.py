@@ -0,0 +1,184 @@
+"""
+Parity and throughput check for inference backends.
+
+Every backend in BACKENDS is run over the dev set plus fixed edge cases
+(empty text, input truncated at max_length, adjacent entities) and its
+entity lists are diffed against the reference predict.py path. Decoding
+rules in bio_to_spans (e.g. an I- tag without a preceding B-) are checked
+on hand-written label sequences. Exits non-zero if an exact backend or a
+decoding check disagrees.
+"""
+import sys
+import copy
+import json
+import time
+import argparse
+
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from compiled import BucketedModel
+from fast_tokenizer import FastWordTokenizer
+from labels import LABEL2ID
+from predict import bio_to_spans, decode_logits, predict_logits_packed, predict_spans, predict_spans_batch, spans_to_entities
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "my name is ramesh sharma 9876543210 rohan verma",
+    "call me on 98765 43210 ramesh dot sharma at gmail dot com chennai",
+    "4242",
+]
+
+# (offsets, labels, expected spans); (0, 0) offsets are special tokens
+DECODING_CASES = [
+    (
+        [(0, 0), (0, 4), (5, 9), (0, 0)],
+        ["O", "I-PHONE", "I-PHONE", "O"],
+        [(0, 9, "PHONE")],
+    ),
+    (
+        [(0, 0), (0, 4), (5, 9), (10, 14), (0, 0)],
+        ["O", "B-CITY", "B-CITY", "I-CITY", "O"],
+        [(0, 4, "CITY"), (5, 14, "CITY")],
+    ),
+    (
+        [(0, 0), (0, 4), (5, 9), (0, 0)],
+        ["O", "B-PERSON_NAME", "I-DATE", "O"],
+        [(0, 4, "PERSON_NAME"), (5, 9, "DATE")],
+    ),
+    (
+        [(0, 0), (0, 4), (5, 9), (0, 0)],
+        ["O", "O", "O", "O"],
+        [],
+    ),
+    (
+        [(0, 0), (0, 0)],
+        ["B-EMAIL", "I-EMAIL"],
+        [],
+    ),
+]
+
+
+def run_reference(model, tokenizer, texts, args):
+    return [predict_spans(model, tokenizer, t, args.max_length, args.device) for t in texts]
+
+
+def run_batched(model, tokenizer, texts, args):
+    spans = []
+    for i in range(0, len(texts), args.batch_size):
+        spans.extend(predict_spans_batch(model, tokenizer, texts[i:i + args.batch_size], args.max_length, args.device))
+    return spans
+
+
+def run_packed(model, tokenizer, texts, args):
+    spans = []
+    for i in range(0, len(texts), args.batch_size):
+        chunk = texts[i:i + args.batch_size]
+        outputs = predict_logits_packed(model, tokenizer, chunk, args.max_length, args.device)
+        spans.extend(decode_logits(t, offsets, logits) for t, (offsets, logits) in zip(chunk, outputs))
+    return spans
+
+
+def run_dynamic_int8(model, tokenizer, texts, args):
+    return [predict_spans(model, tokenizer, t, args.max_length, "cpu") for t in texts]
+
+
+# Setup hooks build whatever a backend runs with and return (model, tokenizer); they are not timed
+
+def setup_fast_tokenizer(model, tokenizer, args):
+    return model, FastWordTokenizer(tokenizer)
+
+
+def setup_dynamic_int8(model, tokenizer, args):
+    qmodel = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+    return qmodel, tokenizer
+
+
+def setup_trace_buckets(model, tokenizer, args):
+    bucketed = BucketedModel(model, mode="trace", pad_token_id=tokenizer.pad_token_id)
+    bucketed.warmup(batch_sizes=(1,), runs=1)
+    return bucketed, tokenizer
+
+
+# name -> (runner, exact, setup or None); approximate backends are reported but never fail the check
+BACKENDS = {
+    "reference": (run_reference, True, None),
+    "batched": (run_batched, True, None),
+    "trace_buckets": (run_reference, True, setup_trace_buckets),
+    "packed": (run_packed, True, None),
+    "fast_tokenizer": (run_batched, True, setup_fast_tokenizer),
+}
+if hasattr(torch, "ao") and hasattr(torch.ao, "quantization"):
+    BACKENDS["dynamic_int8"] = (run_dynamic_int8, False, setup_dynamic_int8)
+
+
+def check_decoding():
+    failures = []
+    for offsets, labels, expected in DECODING_CASES:
+        got = bio_to_spans("", offsets, [LABEL2ID[l] for l in labels])
+        if got != expected:
+            failures.append(f"bio_to_spans({labels}) = {got}, expected {expected}")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--model_name", default=None)
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--batch_size", type=int, default=16)
+    ap.add_argument("--backends", nargs="*", default=None, help="Subset of backends to run (default: all)")
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
+    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
+    model.to(args.device)
+    model.eval()
+
+    texts = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            texts.append(json.loads(line)["text"])
+    # One input long enough to be truncated at max_length
+    texts += EDGE_CASES + [" ".join(texts[:40])]
+
+    failed = False
+    for msg in check_decoding():
+        print(f"DECODING MISMATCH: {msg}")
+        failed = True
+
+    names = args.backends or list(BACKENDS)
+    if "reference" not in names:
+        names = ["reference"] + names
+    reference = None
+    print(f"{'backend':15s} {'utt/sec':>10s} {'mismatches':>11s}")
+    for name in names:
+        runner, exact, setup = BACKENDS[name]
+        backend_model, backend_tokenizer = (model, tokenizer) if setup is None else setup(model, tokenizer, args)
+        start = time.perf_counter()
+        spans = runner(backend_model, backend_tokenizer, texts, args)
+        elapsed = time.perf_counter() - start
+        ents = [spans_to_entities(t, s) for t, s in zip(texts, spans)]
+
+        if reference is None:
+            reference = ents
+            for t, e in zip(texts, ents):
+                if len({(x["start"], x["end"], x["label"]) for x in e}) != len(e):
+                    print(f"DUPLICATE ENTITIES in reference output for {t!r}")
+                    failed = True
+
+        diffs = [(t, r, e) for t, r, e in zip(texts, reference, ents) if r != e]
+        print(f"{name:15s} {len(texts) / elapsed:10.1f} {len(diffs):11d}{'' if exact else '  (approximate)'}")
+        for t, r, e in diffs[:3]:
+            print(f"    text: {t[:80]!r}\n    reference: {r}\n    {name}: {e}")
+        if diffs and exact:
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
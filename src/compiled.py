@@ -0,0 +1,92 @@
+"""
+Shape-bucketed compiled inference.
+
+Inputs are right-padded (attention mask 0) up to the smallest of a few fixed
+lengths, so a TorchScript trace or torch.compile graph is built once per
+(batch size, bucket) and reused instead of being rebuilt for every new
+sequence length. Logits are sliced back to the real length, so callers such
+as predict_logits() see the same output shape as with the eager model.
+"""
+import time
+import warnings
+from types import SimpleNamespace
+
+import torch
+
+DEFAULT_BUCKETS = (32, 64, 128, 256)
+
+
+class _LogitsOnly(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class BucketedModel:
+    def __init__(self, model, buckets=DEFAULT_BUCKETS, mode="trace", pad_token_id=0):
+        if mode not in ("trace", "compile"):
+            raise ValueError(f"Unknown compile mode: {mode}")
+        self.model = model.eval()
+        self.buckets = sorted(buckets)
+        self.mode = mode
+        self.pad_token_id = pad_token_id
+        self.device = next(model.parameters()).device
+        self._wrapped = _LogitsOnly(self.model).eval()
+        self._graphs = {}
+        if mode == "compile":
+            self._compiled = torch.compile(self._wrapped, dynamic=False)
+
+    def bucket_for(self, length):
+        for b in self.buckets:
+            if length <= b:
+                return b
+        return length
+
+    def _graph(self, batch_size, bucket):
+        key = (batch_size, bucket)
+        if key not in self._graphs:
+            if self.mode == "compile":
+                self._graphs[key] = self._compiled
+            else:
+                ids = torch.full((batch_size, bucket), self.pad_token_id, dtype=torch.long, device=self.device)
+                # Trace with a padded position so the masking path is recorded
+                mask = torch.ones(batch_size, bucket, dtype=torch.long, device=self.device)
+                mask[:, -1] = 0
+                with warnings.catch_warnings(), torch.no_grad():
+                    warnings.simplefilter("ignore")
+                    self._graphs[key] = torch.jit.trace(self._wrapped, (ids, mask), check_trace=False)
+        return self._graphs[key]
+
+    def __call__(self, input_ids=None, attention_mask=None):
+        batch_size, length = input_ids.shape
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        bucket = self.bucket_for(length)
+        if bucket > length:
+            pad = bucket - length
+            input_ids = torch.nn.functional.pad(input_ids, (0, pad), value=self.pad_token_id)
+            attention_mask = torch.nn.functional.pad(attention_mask, (0, pad), value=0)
+        with torch.no_grad():
+            logits = self._graph(batch_size, bucket)(input_ids, attention_mask)
+        return SimpleNamespace(logits=logits[:, :length])
+
+    def eval(self):
+        return self
+
+    def warmup(self, batch_sizes=(1,), runs=10):
+        """Build and warm every (batch size, bucket) graph; returns {(batch, bucket): mean ms}"""
+        timings = {}
+        for batch_size in batch_sizes:
+            for bucket in self.buckets:
+                ids = torch.full((batch_size, bucket), self.pad_token_id, dtype=torch.long, device=self.device)
+                mask = torch.ones_like(ids)
+                for _ in range(3):
+                    self(input_ids=ids, attention_mask=mask)
+                start = time.perf_counter()
+                for _ in range(runs):
+                    self(input_ids=ids, attention_mask=mask)
+                timings[(batch_size, bucket)] = (time.perf_counter() - start) * 1000.0 / runs
+        return timings
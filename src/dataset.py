@@ -1,6 +1,62 @@
+import os
+import glob
 import json
+import math
+import random
 from typing import List, Dict, Any
-from torch.utils.data import Dataset
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
+
+
+def encode_example(obj: Dict[str, Any], tokenizer, label2id: Dict[str, int], max_length: int) -> Dict[str, Any]:
+    """Tokenize one JSONL record and project its character spans onto BIO token labels"""
+    text = obj["text"]
+    entities = obj.get("entities", [])
+
+    char_tags = ["O"] * len(text)
+    for e in entities:
+        s, e_idx, lab = e["start"], e["end"], e["label"]
+        if s < 0 or e_idx > len(text) or s >= e_idx:
+            continue
+        char_tags[s] = f"B-{lab}"
+        for i in range(s + 1, e_idx):
+            char_tags[i] = f"I-{lab}"
+
+    enc = tokenizer(
+        text,
+        return_offsets_mapping=True,
+        truncation=True,
+        max_length=max_length,
+        add_special_tokens=True,
+    )
+    offsets = enc["offset_mapping"]
+    input_ids = enc["input_ids"]
+    attention_mask = enc["attention_mask"]
+
+    bio_tags = []
+    for (start, end) in offsets:
+        if start == end:
+            bio_tags.append("O")
+        else:
+            if start < len(char_tags):
+                bio_tags.append(char_tags[start])
+            else:
+                bio_tags.append("O")
+
+    if len(bio_tags) != len(input_ids):
+        bio_tags = ["O"] * len(input_ids)
+
+    label_ids = [label2id.get(t, label2id["O"]) for t in bio_tags]
+
+    return {
+        "id": obj["id"],
+        "text": text,
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "labels": label_ids,
+        "offset_mapping": offsets,
+    }
 
 
 class PIIDataset(Dataset):
@@ -18,54 +74,7 @@ class PIIDataset(Dataset):
                 if not line:
                     continue
                 obj = json.loads(line)
-                text = obj["text"]
-                entities = obj.get("entities", [])
-
-                char_tags = ["O"] * len(text)
-                for e in entities:
-                    s, e_idx, lab = e["start"], e["end"], e["label"]
-                    if s < 0 or e_idx > len(text) or s >= e_idx:
-                        continue
-                    char_tags[s] = f"B-{lab}"
-                    for i in range(s + 1, e_idx):
-                        char_tags[i] = f"I-{lab}"
-
-                enc = tokenizer(
-                    text,
-                    return_offsets_mapping=True,
-                    truncation=True,
-                    max_length=self.max_length,
-                    add_special_tokens=True,
-                )
-                offsets = enc["offset_mapping"]
-                input_ids = enc["input_ids"]
-                attention_mask = enc["attention_mask"]
-
-                bio_tags = []
-                for (start, end) in offsets:
-                    if start == end:
-                        bio_tags.append("O")
-                    else:
-                        if start < len(char_tags):
-                            bio_tags.append(char_tags[start])
-                        else:
-                            bio_tags.append("O")
-
-                if len(bio_tags) != len(input_ids):
-                    bio_tags = ["O"] * len(input_ids)
-
-                label_ids = [self.label2id.get(t, self.label2id["O"]) for t in bio_tags]
-
-                self.items.append(
-                    {
-                        "id": obj["id"],
-                        "text": text,
-                        "input_ids": input_ids,
-                        "attention_mask": attention_mask,
-                        "labels": label_ids,
-                        "offset_mapping": offsets,
-                    }
-                )
+                self.items.append(encode_example(obj, tokenizer, self.label2id, self.max_length))
 
     def __len__(self) -> int:
         return len(self.items)
@@ -92,8 +101,309 @@ def collate_batch(batch, pad_token_id: int, label_pad_id: int = -100):
         "input_ids": input_ids,
         "attention_mask": attention_mask,
         "labels": labels,
+        "num_tokens": sum(len(ids) for ids in input_ids_list),
         "ids": [x["id"] for x in batch],
         "texts": [x["text"] for x in batch],
         "offset_mapping": [x["offset_mapping"] for x in batch],
     }
     return out
+
+
+def save_tokenized(dataset: PIIDataset, out_dir: str):
+    """Write a tokenized dataset as flat arrays that TokenizedPIIDataset can memory-map"""
+    os.makedirs(out_dir, exist_ok=True)
+    lengths = [len(x["input_ids"]) for x in dataset]
+    np.save(os.path.join(out_dir, "input_ids.npy"), np.array([t for x in dataset for t in x["input_ids"]], dtype=np.int32))
+    np.save(os.path.join(out_dir, "labels.npy"), np.array([t for x in dataset for t in x["labels"]], dtype=np.int16))
+    np.save(
+        os.path.join(out_dir, "offsets.npy"),
+        np.array([o for x in dataset for o in x["offset_mapping"]], dtype=np.int32).reshape(-1, 2),
+    )
+    np.save(os.path.join(out_dir, "index.npy"), np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": [x["id"] for x in dataset], "texts": [x["text"] for x in dataset]}, f, ensure_ascii=False)
+
+
+class TokenizedPIIDataset(Dataset):
+    """Read-only view over save_tokenized() output.
+
+    Arrays are opened with mmap_mode="r", so several processes reading the
+    same directory share one copy through the page cache.
+    """
+
+    def __init__(self, path: str):
+        self.input_ids = np.load(os.path.join(path, "input_ids.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.index = np.load(os.path.join(path, "index.npy"), mmap_mode="r")
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.texts = meta["texts"]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        start, end = int(self.index[idx]), int(self.index[idx + 1])
+        return {
+            "id": self.ids[idx],
+            "text": self.texts[idx],
+            "input_ids": self.input_ids[start:end].tolist(),
+            "attention_mask": [1] * (end - start),
+            "labels": self.labels[start:end].tolist(),
+            "offset_mapping": [tuple(o) for o in self.offsets[start:end].tolist()],
+        }
+
+
+def resolve_shards(path: str) -> List[str]:
+    """Expand a comma-separated list of JSONL paths or glob patterns into sorted shard files"""
+    shards = []
+    for part in path.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        matches = sorted(glob.glob(part))
+        shards.extend(matches if matches else [part])
+    return shards
+
+
+class StreamingPIIDataset(IterableDataset):
+    """Streams JSONL shards from disk and tokenizes on the fly.
+
+    Only `shuffle_buffer` encoded examples are held in memory at a time, so
+    memory stays flat regardless of corpus size. With at least as many shards
+    as DataLoader workers each worker reads its own subset of files; otherwise
+    every worker reads all files and keeps every num_workers-th line. Shard
+    order and buffer sampling are seeded from (seed, epoch), so call
+    set_epoch() before each epoch for a fresh but reproducible order.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        tokenizer,
+        label_list: List[str],
+        max_length: int = 256,
+        shuffle_buffer: int = 10000,
+        seed: int = 0,
+    ):
+        self.shards = resolve_shards(path)
+        self.tokenizer = tokenizer
+        self.label2id = {l: i for i, l in enumerate(label_list)}
+        self.max_length = max_length
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self._shard_counts = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def shard_counts(self) -> Dict[str, int]:
+        """Non-empty lines per shard (one streaming pass, then cached)"""
+        if self._shard_counts is None:
+            self._shard_counts = {}
+            for shard in self.shards:
+                with open(shard, "r", encoding="utf-8") as f:
+                    self._shard_counts[shard] = sum(1 for line in f if line.strip())
+        return self._shard_counts
+
+    def count(self) -> int:
+        """Number of non-empty lines across all shards"""
+        return sum(self.shard_counts().values())
+
+    def num_batches(self, batch_size: int, num_workers: int, epoch: int) -> int:
+        """Batches a DataLoader yields in an epoch; every worker emits its own final partial batch"""
+        num_workers = max(1, num_workers)
+        counts = self.shard_counts()
+        total = 0
+        for worker_id in range(num_workers):
+            shards, by_file = self._worker_shards(worker_id, num_workers, epoch)
+            if by_file:
+                n = sum(counts[s] for s in shards)
+            else:
+                n = len(range(worker_id, self.count(), num_workers))
+            total += math.ceil(n / batch_size)
+        return total
+
+    def _worker_shards(self, worker_id: int, num_workers: int, epoch: int):
+        shards = list(self.shards)
+        random.Random(self.seed * 1000003 + epoch).shuffle(shards)
+        by_file = len(shards) >= num_workers
+        if by_file:
+            shards = shards[worker_id::num_workers]
+        return shards, by_file
+
+    def _iter_records(self, worker_id: int, num_workers: int):
+        shards, by_file = self._worker_shards(worker_id, num_workers, self.epoch)
+
+        line_no = 0
+        for shard in shards:
+            with open(shard, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    keep = by_file or line_no % num_workers == worker_id
+                    line_no += 1
+                    if keep:
+                        yield json.loads(line)
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id = info.id if info is not None else 0
+        num_workers = info.num_workers if info is not None else 1
+        rng = random.Random((self.seed * 1000003 + self.epoch) * 1009 + worker_id)
+
+        buffer = []
+        for obj in self._iter_records(worker_id, num_workers):
+            item = encode_example(obj, self.tokenizer, self.label2id, self.max_length)
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = item
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+class HardExampleSampler(Sampler):
+    """Samples mostly the highest-loss examples once a warmup period is over.
+
+    For the first `warmup_epochs` epochs every example is visited. Afterwards
+    each epoch draws the `hard_fraction` of examples with the highest last
+    recorded loss plus a random `replay_fraction` of the remaining ones, so
+    easy examples are still revisited occasionally and their losses refreshed.
+    """
+
+    def __init__(self, num_examples: int, hard_fraction: float = 0.3, replay_fraction: float = 0.1,
+                 warmup_epochs: int = 2, seed: int = 0):
+        self.num_examples = num_examples
+        self.hard_fraction = hard_fraction
+        self.replay_fraction = replay_fraction
+        self.warmup_epochs = warmup_epochs
+        self.seed = seed
+        self.epoch = 0
+        # Unseen examples count as hardest
+        self.losses = [float("inf")] * num_examples
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def update(self, indices: List[int], losses: List[float]):
+        for i, loss in zip(indices, losses):
+            self.losses[i] = loss
+
+    def epoch_size(self, epoch: int) -> int:
+        if epoch < self.warmup_epochs:
+            return self.num_examples
+        num_hard = math.ceil(self.hard_fraction * self.num_examples)
+        num_replay = math.ceil(self.replay_fraction * (self.num_examples - num_hard))
+        return min(self.num_examples, num_hard + num_replay)
+
+    def __len__(self) -> int:
+        return self.epoch_size(self.epoch)
+
+    def __iter__(self):
+        rng = random.Random(self.seed * 1000003 + self.epoch)
+        if self.epoch < self.warmup_epochs:
+            order = list(range(self.num_examples))
+            rng.shuffle(order)
+            return iter(order)
+        ranked = sorted(range(self.num_examples), key=lambda i: -self.losses[i])
+        num_hard = math.ceil(self.hard_fraction * self.num_examples)
+        rest = ranked[num_hard:]
+        chosen = ranked[:num_hard] + rng.sample(rest, len(self) - num_hard)
+        rng.shuffle(chosen)
+        return iter(chosen)
+
+
+def pack_lengths(lengths: List[int], max_length: int) -> List[List[int]]:
+    """First-fit decreasing bin packing; returns groups of indices whose lengths sum to at most max_length"""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    bins = []
+    bin_lens = []
+    for idx in order:
+        n = lengths[idx]
+        for b, used in enumerate(bin_lens):
+            if used + n <= max_length:
+                bins[b].append(idx)
+                bin_lens[b] += n
+                break
+        else:
+            bins.append([idx])
+            bin_lens.append(n)
+    return bins
+
+
+def packed_attention_mask(segment_ids: torch.Tensor) -> torch.Tensor:
+    # (batch, 1, seq, seq): a token attends only to tokens of its own utterance.
+    # Padding (segment 0) attends to padding so no row is fully masked.
+    return (segment_ids[:, :, None] == segment_ids[:, None, :]).unsqueeze(1)
+
+
+class PackedPIIDataset(Dataset):
+    """Packs several tokenized utterances of a PIIDataset into one sequence.
+
+    Every utterance keeps its own [CLS]/[SEP], position ids restart at 0 and a
+    segment id per utterance is used to build a block-diagonal attention mask,
+    so packed examples never attend to each other. Special tokens get the
+    ignore label so no loss is computed at utterance boundaries.
+    """
+
+    def __init__(self, dataset: PIIDataset, max_length: int = 256, label_pad_id: int = -100):
+        self.max_length = max_length
+        self.num_utterances = len(dataset)
+
+        bins = pack_lengths([len(dataset[i]["input_ids"]) for i in range(len(dataset))], max_length)
+
+        self.items = []
+        for members in bins:
+            input_ids, labels, position_ids, segment_ids = [], [], [], []
+            for seg, idx in enumerate(members, start=1):
+                item = dataset[idx]
+                for pos, (tok, lab, (start, end)) in enumerate(
+                    zip(item["input_ids"], item["labels"], item["offset_mapping"])
+                ):
+                    input_ids.append(tok)
+                    labels.append(label_pad_id if start == end else lab)
+                    position_ids.append(pos)
+                    segment_ids.append(seg)
+            self.items.append(
+                {
+                    "ids": [dataset[idx]["id"] for idx in members],
+                    "input_ids": input_ids,
+                    "labels": labels,
+                    "position_ids": position_ids,
+                    "segment_ids": segment_ids,
+                }
+            )
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        return self.items[idx]
+
+
+def collate_packed_batch(batch, pad_token_id: int, label_pad_id: int = -100):
+    max_len = max(len(x["input_ids"]) for x in batch)
+
+    def pad(seq, pad_value, max_len):
+        return seq + [pad_value] * (max_len - len(seq))
+
+    segment_ids = torch.tensor([pad(x["segment_ids"], 0, max_len) for x in batch])
+    attention_mask = packed_attention_mask(segment_ids)
+
+    out = {
+        "input_ids": [pad(x["input_ids"], pad_token_id, max_len) for x in batch],
+        "attention_mask": attention_mask,
+        "position_ids": [pad(x["position_ids"], 0, max_len) for x in batch],
+        "labels": [pad(x["labels"], label_pad_id, max_len) for x in batch],
+        "num_tokens": int((segment_ids > 0).sum()),
+        "ids": [uid for x in batch for uid in x["ids"]],
+    }
+    return out
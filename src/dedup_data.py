@@ -0,0 +1,210 @@
+"""
+Near-duplicate detection and coverage-aware subsampling of training data.
+
+Utterances are fingerprinted with MinHash over word shingles after masking
+digits and spoken digit words, so two utterances built from the same
+templates that differ only in their numbers hash alike. Near-duplicates are
+found with LSH banding and collapsed to a few representatives per cluster,
+picked to keep (entity label, surface form) coverage balanced, e.g. spoken
+vs digit phone numbers.
+"""
+import re
+import json
+import time
+import zlib
+import heapq
+import argparse
+from collections import Counter, defaultdict
+
+import numpy as np
+
+SPOKEN_DIGITS = {"zero", "oh", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine"}
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_tokens(text):
+    tokens = []
+    for tok in text.lower().split():
+        if tok in SPOKEN_DIGITS:
+            tokens.append("<num>")
+        else:
+            tokens.append(re.sub(r"\d", "0", tok))
+    return tokens
+
+
+def shingles(tokens, n):
+    if len(tokens) < n:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm=64, seed=0):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, items):
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in items], dtype=np.uint64)
+        perm = (hashes[:, None] * self.a[None, :] + self.b[None, :]) % MERSENNE_PRIME
+        return perm.min(axis=0)
+
+
+def surface_form(entity_text):
+    words = entity_text.lower().split()
+    has_digit = any(re.search(r"\d", w) for w in words)
+    has_spoken = any(w in SPOKEN_DIGITS for w in words)
+    if has_digit and has_spoken:
+        return "mixed"
+    if has_digit:
+        return "digit"
+    if has_spoken:
+        return "spoken"
+    return "text"
+
+
+def coverage_keys(obj):
+    text = obj["text"]
+    return {(e["label"], surface_form(text[e["start"]:e["end"]])) for e in obj.get("entities", [])}
+
+
+def find_clusters(signatures, bands, threshold):
+    """Union-find over LSH candidate pairs whose estimated Jaccard is >= threshold"""
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i, sig in enumerate(signatures):
+            buckets[sig[band * rows:(band + 1) * rows].tobytes()].append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                ra, rb = find(first), find(other)
+                if ra == rb:
+                    continue
+                if np.mean(signatures[first] == signatures[other]) >= threshold:
+                    parent[rb] = ra
+
+    clusters = defaultdict(list)
+    for i in range(len(signatures)):
+        clusters[find(i)].append(i)
+    return list(clusters.values())
+
+
+def greedy_pick(candidates, keys, counts, k):
+    """Lazy greedy: pick k candidates by coverage gain, updating counts in place.
+
+    Gains only shrink as counts grow, so a stale heap entry is an upper bound
+    and only the top entry needs rescoring.
+    """
+    def gain(i):
+        return sum(1.0 / (1 + counts[key]) for key in keys[i])
+
+    heap = [(-gain(i), i) for i in candidates]
+    heapq.heapify(heap)
+    picked = []
+    while heap and len(picked) < k:
+        _, i = heapq.heappop(heap)
+        g = gain(i)
+        if heap and -heap[0][0] > g:
+            heapq.heappush(heap, (-g, i))
+            continue
+        picked.append(i)
+        counts.update(keys[i])
+    return picked
+
+
+def select(records, clusters, per_cluster, max_size):
+    """Greedy selection favouring examples whose coverage keys are still rare"""
+    keys = [coverage_keys(r) for r in records]
+    counts = Counter()
+
+    selected = []
+    for members in sorted(clusters, key=len, reverse=True):
+        selected.extend(greedy_pick(members, keys, counts, per_cluster))
+
+    if max_size and len(selected) > max_size:
+        selected = greedy_pick(selected, keys, Counter(), max_size)
+
+    # Never drop a (label, form) combination entirely
+    all_keys = Counter(k for ks in keys for k in ks)
+    kept_keys = Counter(k for i in selected for k in keys[i])
+    chosen = set(selected)
+    for k in all_keys:
+        if kept_keys[k] == 0:
+            i = next(i for i in range(len(records)) if k in keys[i] and i not in chosen)
+            selected.append(i)
+            chosen.add(i)
+            kept_keys.update(keys[i])
+
+    return sorted(selected), all_keys, kept_keys
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default="data/train.jsonl")
+    ap.add_argument("--output", default="data/train_dedup.jsonl")
+    ap.add_argument("--shingle", type=int, default=3, help="Words per shingle")
+    ap.add_argument("--num_perm", type=int, default=64)
+    ap.add_argument("--bands", type=int, default=16)
+    ap.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard for near-duplicates")
+    ap.add_argument("--per_cluster", type=int, default=1, help="Representatives kept per near-duplicate cluster")
+    ap.add_argument("--max_size", type=int, default=0, help="Optional cap on the output size")
+    ap.add_argument("--compare", action="store_true", help="Train on full and reduced data and compare time and dev F1")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--model_name", default="distilbert-base-uncased")
+    ap.add_argument("--epochs", type=int, default=50)
+    ap.add_argument("--compare_dir", default="out", help="--compare saves models to <compare_dir>_full and <compare_dir>_reduced")
+    args = ap.parse_args()
+
+    records = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+
+    hasher = MinHasher(num_perm=args.num_perm)
+    signatures = np.stack(
+        [hasher.signature(shingles(normalize_tokens(r["text"]), args.shingle)) for r in records]
+    )
+    clusters = find_clusters(signatures, args.bands, args.threshold)
+    selected, all_keys, kept_keys = select(records, clusters, args.per_cluster, args.max_size)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        for i in selected:
+            f.write(json.dumps(records[i], ensure_ascii=False) + "\n")
+
+    print(f"Input utterances:        {len(records)}")
+    print(f"Near-duplicate clusters: {len(clusters)}")
+    print(f"Output utterances:       {len(selected)} ({100.0 * (1 - len(selected) / max(1, len(records))):.1f}% smaller)")
+    print("\nCoverage (label, surface form): before -> after")
+    for k in sorted(all_keys):
+        print(f"  {k[0]:15s} {k[1]:7s} {all_keys[k]:6d} -> {kept_keys[k]:6d}")
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        from train import parse_args as train_parse_args, train
+
+        for name, path in [("full", args.input), ("reduced", args.output)]:
+            start = time.perf_counter()
+            metrics = train(train_parse_args([
+                "--model_name", args.model_name,
+                "--train", path,
+                "--dev", args.dev,
+                "--epochs", str(args.epochs),
+                "--out_dir", f"{args.compare_dir}_{name}",
+            ]))
+            elapsed = time.perf_counter() - start
+            print(f"[{name}] training time: {elapsed:.1f} s  dev PII-F1: {metrics['pii'][2]:.3f}  Macro-F1: {metrics['macro_f1']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -36,15 +36,8 @@ def compute_prf(tp, fp, fn):
     return prec, rec, f1
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--gold", required=True)
-    ap.add_argument("--pred", required=True)
-    args = ap.parse_args()
-
-    gold = load_gold(args.gold)
-    pred = load_pred(args.pred)
-
+def span_f1(gold, pred):
+    """Span-level metrics for gold/pred dicts of uid -> [(start, end, label)]"""
     labels = set()
     for spans in gold.values():
         for _, _, lab in spans:
@@ -67,18 +60,10 @@ def main():
             if span not in p_spans:
                 fn[span[2]] += 1
 
-    print("Per-entity metrics:")
-    macro_f1_sum = 0.0
-    macro_count = 0
-
+    per_label = {}
     for lab in sorted(labels):
-        p, r, f1 = compute_prf(tp[lab], fp[lab], fn[lab])
-        print(f"{lab:15s} P={p:.3f} R={r:.3f} F1={f1:.3f}")
-        macro_f1_sum += f1
-        macro_count += 1
-
-    macro_f1 = macro_f1_sum / max(1, macro_count)
-    print(f"\nMacro-F1: {macro_f1:.3f}")
+        per_label[lab] = compute_prf(tp[lab], fp[lab], fn[lab])
+    macro_f1 = sum(f1 for _, _, f1 in per_label.values()) / max(1, len(per_label))
 
     pii_tp = pii_fp = pii_fn = 0
     non_tp = non_fp = non_fn = 0
@@ -110,9 +95,33 @@ def main():
             if span not in p_non:
                 non_fn += 1
 
-    p, r, f1 = compute_prf(pii_tp, pii_fp, pii_fn)
+    return {
+        "per_label": per_label,
+        "macro_f1": macro_f1,
+        "pii": compute_prf(pii_tp, pii_fp, pii_fn),
+        "non_pii": compute_prf(non_tp, non_fp, non_fn),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--gold", required=True)
+    ap.add_argument("--pred", required=True)
+    args = ap.parse_args()
+
+    gold = load_gold(args.gold)
+    pred = load_pred(args.pred)
+    metrics = span_f1(gold, pred)
+
+    print("Per-entity metrics:")
+    for lab, (p, r, f1) in metrics["per_label"].items():
+        print(f"{lab:15s} P={p:.3f} R={r:.3f} F1={f1:.3f}")
+
+    print(f"\nMacro-F1: {metrics['macro_f1']:.3f}")
+
+    p, r, f1 = metrics["pii"]
     print(f"\nPII-only metrics: P={p:.3f} R={r:.3f} F1={f1:.3f}")
-    p2, r2, f12 = compute_prf(non_tp, non_fp, non_fn)
+    p2, r2, f12 = metrics["non_pii"]
     print(f"Non-PII metrics: P={p2:.3f} R={r2:.3f} F1={f12:.3f}")
 
 
@@ -0,0 +1,249 @@
+"""
+Memoized word-level tokenizer for lowercase STT transcripts.
+
+Transcripts are whitespace-separated words from a small, repetitive
+vocabulary, so the WordPiece split of each word is computed once from the
+model's vocab.txt and kept in a bounded LRU memo; input_ids, attention masks
+and offsets are then assembled directly from the cached pieces. Texts outside
+the printable-ASCII fast path (accents, CJK, tabs, control characters) or
+containing a literal special or added token such as "[SEP]" are handed to
+the reference tokenizer, so output matches AutoTokenizer exactly.
+FastWordTokenizer accepts the call arguments used by encode_example() and
+predict_logits(); other attributes are delegated to the reference tokenizer.
+
+Running this file checks parity against AutoTokenizer on the corpus and
+reports speedup and cache hit rate.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from functools import lru_cache
+
+import torch
+from transformers import AutoTokenizer
+
+DEFAULT_CACHE_SIZE = 50000
+
+_FAST_TEXT = re.compile(r"[ -~]*")
+_WORD = re.compile(r"\S+")
+# BERT pre-tokenization splits every ASCII non-alphanumeric character into its own token
+_CHUNK = re.compile(r"[A-Za-z0-9]+|[^A-Za-z0-9]")
+
+
+def load_vocab(path):
+    vocab = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            vocab[line.rstrip("\n")] = i
+    return vocab
+
+
+class FastWordTokenizer:
+    def __init__(self, tokenizer, vocab_file=None, cache_size=DEFAULT_CACHE_SIZE, max_input_chars_per_word=100):
+        """Wrap a loaded tokenizer; vocab_file defaults to vocab.txt next to it, else its in-memory vocabulary"""
+        self.tokenizer = tokenizer
+        if vocab_file is None:
+            vocab_file = os.path.join(tokenizer.name_or_path, "vocab.txt")
+        self.vocab = load_vocab(vocab_file) if os.path.exists(vocab_file) else tokenizer.get_vocab()
+        self.lowercase = getattr(tokenizer, "do_lower_case", True)
+        self.max_input_chars_per_word = max_input_chars_per_word
+        self.unk_id = self.vocab[tokenizer.unk_token]
+        self.cls_id = self.vocab[tokenizer.cls_token]
+        self.sep_id = self.vocab[tokenizer.sep_token]
+        # The reference tokenizer matches these verbatim before splitting words
+        self.special_tokens = tuple(sorted(set(tokenizer.all_special_tokens) | set(tokenizer.get_added_vocab())))
+        self.fallback_texts = 0
+        self.cache_size = cache_size
+        self.word_pieces = lru_cache(maxsize=cache_size)(self._word_pieces)
+
+    @classmethod
+    def from_pretrained(cls, model_dir, cache_size=DEFAULT_CACHE_SIZE):
+        return cls(AutoTokenizer.from_pretrained(model_dir), cache_size=cache_size)
+
+    def __getattr__(self, name):
+        if name == "tokenizer":
+            raise AttributeError(name)
+        return getattr(self.tokenizer, name)
+
+    # DataLoader workers get a copy with an empty memo
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["word_pieces"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.word_pieces = lru_cache(maxsize=self.cache_size)(self._word_pieces)
+
+    def _wordpiece(self, chunk, base):
+        if len(chunk) > self.max_input_chars_per_word:
+            return [(self.unk_id, base, base + len(chunk))]
+        text = chunk.lower() if self.lowercase else chunk
+        pieces = []
+        start = 0
+        while start < len(text):
+            end = len(text)
+            piece_id = None
+            while start < end:
+                sub = text[start:end] if start == 0 else "##" + text[start:end]
+                if sub in self.vocab:
+                    piece_id = self.vocab[sub]
+                    break
+                end -= 1
+            if piece_id is None:
+                return [(self.unk_id, base, base + len(chunk))]
+            pieces.append((piece_id, base + start, base + end))
+            start = end
+        return pieces
+
+    def _word_pieces(self, word):
+        """(id, start, end) per WordPiece of one whitespace-free ASCII word, offsets relative to the word"""
+        pieces = []
+        for m in _CHUNK.finditer(word):
+            pieces.extend(self._wordpiece(m.group(), m.start()))
+        return tuple(pieces)
+
+    def encode(self, text, max_length=None, add_special_tokens=True):
+        """Returns (input_ids, offsets) for one text"""
+        if not _FAST_TEXT.fullmatch(text) or any(tok in text for tok in self.special_tokens):
+            self.fallback_texts += 1
+            enc = self.tokenizer(
+                text,
+                return_offsets_mapping=True,
+                truncation=max_length is not None,
+                max_length=max_length,
+                add_special_tokens=add_special_tokens,
+            )
+            return enc["input_ids"], list(enc["offset_mapping"])
+
+        ids, offsets = [], []
+        for m in _WORD.finditer(text):
+            base = m.start()
+            for piece_id, start, end in self.word_pieces(m.group()):
+                ids.append(piece_id)
+                offsets.append((base + start, base + end))
+        if max_length is not None:
+            budget = max_length - 2 if add_special_tokens else max_length
+            ids, offsets = ids[:budget], offsets[:budget]
+        if add_special_tokens:
+            ids = [self.cls_id] + ids + [self.sep_id]
+            offsets = [(0, 0)] + offsets + [(0, 0)]
+        return ids, offsets
+
+    def __call__(self, text, return_offsets_mapping=False, truncation=False, max_length=None,
+                 padding=False, return_tensors=None, add_special_tokens=True):
+        batched = not isinstance(text, str)
+        texts = list(text) if batched else [text]
+        if truncation and max_length is None:
+            max_length = self.tokenizer.model_max_length
+        encoded = [self.encode(t, max_length if truncation else None, add_special_tokens) for t in texts]
+
+        input_ids = [ids for ids, _ in encoded]
+        offsets = [offs for _, offs in encoded]
+        attention_mask = [[1] * len(ids) for ids in input_ids]
+        if padding:
+            width = max(len(ids) for ids in input_ids)
+            for ids, offs, mask in zip(input_ids, offsets, attention_mask):
+                pad = width - len(ids)
+                ids.extend([self.tokenizer.pad_token_id] * pad)
+                offs.extend([(0, 0)] * pad)
+                mask.extend([0] * pad)
+
+        out = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if return_offsets_mapping:
+            out["offset_mapping"] = offsets
+        if return_tensors == "pt":
+            return {k: torch.tensor(v, dtype=torch.long) for k, v in out.items()}
+        if not batched:
+            out = {k: v[0] for k, v in out.items()}
+        return out
+
+    def stats(self):
+        info = self.word_pieces.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            "word_lookups": lookups,
+            "hit_rate": info.hits / max(1, lookups),
+            "cached_words": info.currsize,
+            "fallback_texts": self.fallback_texts,
+        }
+
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "  leading and  double  spaces ",
+    "ramesh.sharma@gmail.com 98765-43210",
+    "supercalifragilisticexpialidocious qqqxzzv",
+    "x" * 150,
+    "José lives in Zürich",
+    "tab\tseparated\nlines",
+    "my [SEP] is here",
+    "hello [UNK] x",
+    "a[MASK]b [CLS][PAD]",
+    "[sep] in lowercase is plain text",
+]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--inputs", nargs="+", default=["data/train.jsonl", "data/dev.jsonl", "data/test.jsonl"])
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--batch_size", type=int, default=16)
+    ap.add_argument("--cache_size", type=int, default=DEFAULT_CACHE_SIZE)
+    args = ap.parse_args()
+
+    reference = AutoTokenizer.from_pretrained(args.model_dir)
+    fast = FastWordTokenizer.from_pretrained(args.model_dir, args.cache_size)
+
+    texts = []
+    for path in args.inputs:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    texts.append(json.loads(line)["text"])
+    texts += EDGE_CASES + [" ".join(texts[:40])]
+
+    # Parity: single texts as in encode_example(), padded tensor batches as in predict_logits()
+    mismatches = 0
+    for t in texts:
+        kwargs = dict(return_offsets_mapping=True, truncation=True, max_length=args.max_length)
+        a, b = reference(t, **kwargs), fast(t, **kwargs)
+        if a["input_ids"] != b["input_ids"] or list(a["offset_mapping"]) != b["offset_mapping"]:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"MISMATCH: {t[:80]!r}\n    reference: {a['input_ids']}\n    fast:      {b['input_ids']}")
+    for i in range(0, len(texts), args.batch_size):
+        kwargs = dict(return_offsets_mapping=True, truncation=True, max_length=args.max_length,
+                      padding=True, return_tensors="pt")
+        a, b = reference(texts[i:i + args.batch_size], **kwargs), fast(texts[i:i + args.batch_size], **kwargs)
+        if any(not torch.equal(a[k], b[k]) for k in ("input_ids", "attention_mask", "offset_mapping")):
+            mismatches += 1
+            print(f"BATCH MISMATCH at texts {i}..{i + args.batch_size}")
+
+    # Speed: one pass over the corpus, one text per call, each tokenizer starting cold
+    fast = FastWordTokenizer.from_pretrained(args.model_dir, args.cache_size)
+    timings = {}
+    for name, tok in (("AutoTokenizer", reference), ("FastWordTokenizer", fast)):
+        start = time.perf_counter()
+        for t in texts:
+            tok(t, return_offsets_mapping=True, truncation=True, max_length=args.max_length)
+        timings[name] = time.perf_counter() - start
+    for name, seconds in timings.items():
+        print(f"{name:18s} {len(texts) / seconds:10.0f} texts/sec")
+    stats = fast.stats()
+    print(
+        f"Speedup: {timings['AutoTokenizer'] / timings['FastWordTokenizer']:.2f}x; "
+        f"cache hit rate {100.0 * stats['hit_rate']:.1f}% over {stats['word_lookups']} words "
+        f"({stats['cached_words']} cached, {stats['fallback_texts']} texts via fallback)"
+    )
+    print(f"Mismatches against AutoTokenizer on {len(texts)} texts: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
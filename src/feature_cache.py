@@ -0,0 +1,131 @@
+"""
+Frozen lower-encoder feature caching for head/top-layer retraining.
+
+The embeddings and the lower N transformer layers are run once over the
+training set and their output hidden states are written to a memory-mapped
+file. Training then feeds those states straight into the upper layers, so
+later epochs never touch the frozen part of the network.
+"""
+import json
+from contextlib import contextmanager
+from typing import Dict, Any
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+class _Passthrough(torch.nn.Module):
+    """Stands in for the embedding module when inputs_embeds are cached hidden states"""
+
+    def forward(self, input_ids=None, inputs_embeds=None, *args, **kwargs):
+        return inputs_embeds
+
+
+def _layer_container(model):
+    base = model.base_model
+    if hasattr(base, "transformer"):  # DistilBERT
+        return base.transformer
+    return base.encoder  # BERT-style encoders
+
+
+def freeze_lower(model, num_layers: int):
+    """Disable gradients for the embeddings and the first num_layers encoder layers"""
+    for p in model.base_model.embeddings.parameters():
+        p.requires_grad = False
+    for layer in _layer_container(model).layer[:num_layers]:
+        for p in layer.parameters():
+            p.requires_grad = False
+
+
+@contextmanager
+def truncated_encoder(model, num_layers: int, part: str):
+    """Temporarily keep only the lower ("lower") or upper ("upper") part of the encoder.
+
+    With part="upper" the embedding module is bypassed, so the model must be
+    called with inputs_embeds set to the cached lower-layer hidden states.
+    """
+    container = _layer_container(model)
+    base = model.base_model
+    layers, embeddings = container.layer, base.embeddings
+    if part == "lower":
+        container.layer = torch.nn.ModuleList(layers[:num_layers])
+    else:
+        container.layer = torch.nn.ModuleList(layers[num_layers:])
+        base.embeddings = _Passthrough()
+    try:
+        yield model
+    finally:
+        container.layer = layers
+        base.embeddings = embeddings
+
+
+def build_feature_cache(model, dataset, num_layers: int, path: str, device, fp16: bool = False, batch_size: int = 32):
+    """Run the frozen lower part once over dataset and store one row per token in path"""
+    lengths = [len(x["input_ids"]) for x in dataset]
+    index = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    hidden_size = model.config.hidden_size
+    dtype = np.float16 if fp16 else np.float32
+    features = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(int(index[-1]), hidden_size))
+
+    was_training = model.training
+    model.eval()
+    with truncated_encoder(model, num_layers, "lower"), torch.no_grad():
+        for start in range(0, len(dataset), batch_size):
+            items = [dataset[i] for i in range(start, min(start + batch_size, len(dataset)))]
+            max_len = max(len(x["input_ids"]) for x in items)
+            input_ids = torch.tensor([x["input_ids"] + [0] * (max_len - len(x["input_ids"])) for x in items], device=device)
+            attention_mask = torch.tensor(
+                [[1] * len(x["input_ids"]) + [0] * (max_len - len(x["input_ids"])) for x in items], device=device
+            )
+            hidden = model.base_model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            hidden = hidden.cpu().numpy().astype(dtype)
+            for j, x in enumerate(items):
+                i = start + j
+                features[index[i]:index[i + 1]] = hidden[j, : len(x["input_ids"])]
+    features.flush()
+    model.train(was_training)
+
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump({"num_layers": num_layers, "index": index.tolist()}, f)
+    return CachedFeatureDataset(dataset, path)
+
+
+class CachedFeatureDataset(Dataset):
+    """Pairs a tokenized dataset with its memory-mapped lower-layer hidden states"""
+
+    def __init__(self, dataset, path: str):
+        self.dataset = dataset
+        self.features = np.load(path, mmap_mode="r")
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.index = meta["index"]
+        self.num_layers = meta["num_layers"]
+        if len(self.index) - 1 != len(dataset):
+            raise ValueError(f"Feature cache {path} has {len(self.index) - 1} examples, dataset has {len(dataset)}")
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        item = dict(self.dataset[idx])
+        item["hidden_states"] = torch.from_numpy(np.array(self.features[self.index[idx]:self.index[idx + 1]]))
+        return item
+
+
+def collate_cached_batch(batch, pad_token_id: int = 0, label_pad_id: int = -100):
+    max_len = max(x["hidden_states"].shape[0] for x in batch)
+    hidden = torch.zeros(len(batch), max_len, batch[0]["hidden_states"].shape[1], dtype=torch.float32)
+    for i, x in enumerate(batch):
+        hidden[i, : x["hidden_states"].shape[0]] = x["hidden_states"].float()
+
+    def pad(seq, pad_value, max_len):
+        return seq + [pad_value] * (max_len - len(seq))
+
+    return {
+        "hidden_states": hidden,
+        "attention_mask": [pad(x["attention_mask"], 0, max_len) for x in batch],
+        "labels": [pad(x["labels"], label_pad_id, max_len) for x in batch],
+        "num_tokens": sum(len(x["input_ids"]) for x in batch),
+        "ids": [x["id"] for x in batch],
+    }
@@ -0,0 +1,149 @@
+"""
+Warm-start fine-tuning of an existing model directory on new transcripts.
+
+The base model (e.g. out/) is trained for a few epochs on only the new data,
+mixed with examples drawn from a bounded replay buffer of earlier data to
+limit forgetting. The buffer is a reservoir sample stored next to each model
+version (replay.jsonl), so the cost of a fine-tune grows with the size of the
+new batch, not with the whole corpus. Results are saved as a new version
+directory next to the base one (out -> out_v2 -> out_v3 ...).
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+
+from train import parse_args as train_parse_args, train
+
+REPLAY_FILE = "replay.jsonl"
+VERSION_FILE = "version.json"
+
+
+def read_jsonl(path):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def reservoir_update(buffer, seen, records, capacity, rng):
+    """Add records to a uniform reservoir sample of everything seen so far"""
+    for r in records:
+        seen += 1
+        if len(buffer) < capacity:
+            buffer.append(r)
+        else:
+            j = rng.randrange(seen)
+            if j < capacity:
+                buffer[j] = r
+    return buffer, seen
+
+
+def next_version_dir(base_dir):
+    base_dir = base_dir.rstrip("/")
+    m = re.match(r"^(.*)_v(\d+)$", base_dir)
+    stem, version = (m.group(1), int(m.group(2))) if m else (base_dir, 1)
+    version += 1
+    while os.path.exists(f"{stem}_v{version}"):
+        version += 1
+    return f"{stem}_v{version}"
+
+
+def load_replay(base_dir, replay_source, capacity, rng):
+    path = os.path.join(base_dir, REPLAY_FILE)
+    if os.path.exists(path):
+        with open(os.path.join(base_dir, VERSION_FILE), "r", encoding="utf-8") as f:
+            seen = json.load(f)["replay_seen"]
+        return read_jsonl(path), seen
+    if replay_source is None:
+        return [], 0
+    # First warm start from a model trained by train.py: sample its training data once
+    buffer, seen = [], 0
+    with open(replay_source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                buffer, seen = reservoir_update(buffer, seen, [json.loads(line)], capacity, rng)
+    return buffer, seen
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base_dir", default="out")
+    ap.add_argument("--new", required=True, help="JSONL with the new transcripts")
+    ap.add_argument("--replay_source", default="data/train.jsonl",
+                    help="Original training data, sampled only when base_dir has no replay buffer yet")
+    ap.add_argument("--replay_size", type=int, default=2000, help="Replay buffer capacity")
+    ap.add_argument("--replay_ratio", type=float, default=1.0, help="Replayed examples per new example")
+    ap.add_argument("--out_dir", default=None, help="Defaults to the next version next to base_dir")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--epochs", type=int, default=3)
+    ap.add_argument("--lr", type=float, default=2e-5)
+    ap.add_argument("--batch_size", type=int, default=16)
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--pii_weight", type=float, default=2.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    out_dir = args.out_dir or next_version_dir(args.base_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    new_records = read_jsonl(args.new)
+    buffer, seen = load_replay(args.base_dir, args.replay_source, args.replay_size, rng)
+    num_replay = min(len(buffer), int(round(args.replay_ratio * len(new_records))))
+    mix = new_records + rng.sample(buffer, num_replay)
+    rng.shuffle(mix)
+    mix_path = os.path.join(out_dir, "finetune_mix.jsonl")
+    write_jsonl(mix_path, mix)
+    print(f"Fine-tuning {args.base_dir} on {len(new_records)} new + {num_replay} replayed utterances -> {out_dir}")
+
+    start = time.perf_counter()
+    metrics = train(train_parse_args([
+        "--model_name", args.base_dir,
+        "--train", mix_path,
+        "--dev", args.dev,
+        "--out_dir", out_dir,
+        "--epochs", str(args.epochs),
+        "--lr", str(args.lr),
+        "--batch_size", str(args.batch_size),
+        "--max_length", str(args.max_length),
+        "--pii_weight", str(args.pii_weight),
+    ]))
+    elapsed = time.perf_counter() - start
+    os.remove(mix_path)
+
+    buffer, seen = reservoir_update(buffer, seen, new_records, args.replay_size, rng)
+    write_jsonl(os.path.join(out_dir, REPLAY_FILE), buffer)
+    with open(os.path.join(out_dir, VERSION_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "parent": args.base_dir,
+                "new_data": args.new,
+                "num_new": len(new_records),
+                "num_replayed": num_replay,
+                "replay_seen": seen,
+                "replay_size": args.replay_size,
+                "train_seconds": round(elapsed, 2),
+                "dev_pii_f1": metrics["pii"][2] if metrics else None,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Fine-tuned in {elapsed:.1f}s; replay buffer holds {len(buffer)} of {seen} utterances seen")
+    print(f"Saved version to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
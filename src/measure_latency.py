@@ -6,32 +6,11 @@ import statistics
 import torch
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 
+from compiled import DEFAULT_BUCKETS, BucketedModel
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--model_dir", default="out")
-    ap.add_argument("--model_name", default=None)
-    ap.add_argument("--input", default="data/dev.jsonl")
-    ap.add_argument("--max_length", type=int, default=256)
-    ap.add_argument("--runs", type=int, default=50)
-    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
-    args = ap.parse_args()
-
-    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
-    model.to(args.device)
-    model.eval()
-
-    texts = []
-    with open(args.input, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            texts.append(obj["text"])
-
-    if not texts:
-        print("No texts found in input file.")
-        return
 
+def measure(model, tokenizer, texts, max_length, runs, device):
+    """Return (p50, p95) forward latency in ms at batch size 1"""
     times_ms = []
 
     # warmup
@@ -40,29 +19,65 @@ def main():
         enc = tokenizer(
             t,
             truncation=True,
-            max_length=args.max_length,
+            max_length=max_length,
             return_tensors="pt",
         )
         with torch.no_grad():
-            _ = model(input_ids=enc["input_ids"].to(args.device), attention_mask=enc["attention_mask"].to(args.device))
+            _ = model(input_ids=enc["input_ids"].to(device), attention_mask=enc["attention_mask"].to(device))
 
-    for i in range(args.runs):
+    for i in range(runs):
         t = texts[i % len(texts)]
         enc = tokenizer(
             t,
             truncation=True,
-            max_length=args.max_length,
+            max_length=max_length,
             return_tensors="pt",
         )
         start = time.perf_counter()
         with torch.no_grad():
-            _ = model(input_ids=enc["input_ids"].to(args.device), attention_mask=enc["attention_mask"].to(args.device))
+            _ = model(input_ids=enc["input_ids"].to(device), attention_mask=enc["attention_mask"].to(device))
         end = time.perf_counter()
         times_ms.append((end - start) * 1000.0)
 
     p50 = statistics.median(times_ms)
     times_sorted = sorted(times_ms)
     p95 = times_sorted[int(0.95 * len(times_sorted)) - 1]
+    return p50, p95
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--model_name", default=None)
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--runs", type=int, default=50)
+    ap.add_argument("--compile", default="none", choices=["none", "trace", "compile"])
+    ap.add_argument("--buckets", nargs="+", type=int, default=list(DEFAULT_BUCKETS))
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
+    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
+    model.to(args.device)
+    model.eval()
+    if args.compile != "none":
+        model = BucketedModel(model, args.buckets, args.compile, tokenizer.pad_token_id)
+        print(f"Per-bucket latency ({args.compile}, batch_size=1):")
+        for (_, bucket), ms in model.warmup().items():
+            print(f"  {bucket:4d} tokens: {ms:.2f} ms")
+
+    texts = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            obj = json.loads(line)
+            texts.append(obj["text"])
+
+    if not texts:
+        print("No texts found in input file.")
+        return
+
+    p50, p95 = measure(model, tokenizer, texts, args.max_length, args.runs, args.device)
 
     print(f"Latency over {args.runs} runs (batch_size=1):")
     print(f"  p50: {p50:.2f} ms")
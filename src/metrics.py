@@ -0,0 +1,156 @@
+"""
+Low-overhead inference metrics with Prometheus text exposition.
+
+Counters and fixed-bucket histograms are plain Python ints updated from the
+prediction path; rendering happens only when the metrics are written to a
+file or scraped from the local HTTP endpoint.
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1, 0.25, 0.5, 1.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+STAGES = ("tokenize", "forward", "decode")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        sep = "," if labels else ""
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class InferenceMetrics:
+    def __init__(self, throughput_window: float = 60.0):
+        self.start_time = time.time()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.stage_latency = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.utterances = 0
+        self.utterances_with_pii = 0
+        self.truncated = 0
+        self.entities = {}
+        self.throughput_window = throughput_window
+        self._recent = deque()
+
+    def observe_stage(self, stage, seconds):
+        self.stage_latency[stage].observe(seconds)
+
+    def observe_batch(self, batch_size, seconds, truncated=0):
+        """Record one end-to-end batch: size, latency and how many inputs hit max_length"""
+        now = time.time()
+        self.batch_size.observe(batch_size)
+        self.latency.observe(seconds)
+        self.utterances += batch_size
+        self.truncated += truncated
+        self._recent.append((now, batch_size))
+        while self._recent and self._recent[0][0] < now - self.throughput_window:
+            self._recent.popleft()
+
+    def observe_entities(self, ents):
+        has_pii = False
+        for e in ents:
+            self.entities[e["label"]] = self.entities.get(e["label"], 0) + 1
+            has_pii = has_pii or e["pii"]
+        self.utterances_with_pii += int(has_pii)
+
+    def throughput(self):
+        if not self._recent:
+            return 0.0
+        span = max(time.time() - self._recent[0][0], 1e-9)
+        return sum(n for _, n in self._recent) / span
+
+    def render(self):
+        lines = [
+            "# HELP pii_batch_latency_seconds End-to-end latency of a prediction batch.",
+            "# TYPE pii_batch_latency_seconds histogram",
+        ]
+        lines += self.latency.render("pii_batch_latency_seconds")
+        lines += [
+            "# HELP pii_stage_latency_seconds Latency per prediction stage.",
+            "# TYPE pii_stage_latency_seconds histogram",
+        ]
+        for stage, hist in self.stage_latency.items():
+            lines += hist.render("pii_stage_latency_seconds", f'stage="{stage}"')
+        lines += [
+            "# HELP pii_batch_size Utterances per forward pass.",
+            "# TYPE pii_batch_size histogram",
+        ]
+        lines += self.batch_size.render("pii_batch_size")
+        lines += [
+            "# HELP pii_utterances_total Utterances tagged.",
+            "# TYPE pii_utterances_total counter",
+            f"pii_utterances_total {self.utterances}",
+            "# HELP pii_utterances_with_pii_total Utterances with at least one PII entity.",
+            "# TYPE pii_utterances_with_pii_total counter",
+            f"pii_utterances_with_pii_total {self.utterances_with_pii}",
+            "# HELP pii_pii_rate Fraction of utterances with at least one PII entity.",
+            "# TYPE pii_pii_rate gauge",
+            f"pii_pii_rate {self.utterances_with_pii / max(1, self.utterances):.6f}",
+            "# HELP pii_truncated_total Inputs truncated at max_length.",
+            "# TYPE pii_truncated_total counter",
+            f"pii_truncated_total {self.truncated}",
+            "# HELP pii_entities_total Entities emitted per label.",
+            "# TYPE pii_entities_total counter",
+        ]
+        for label in sorted(self.entities):
+            lines.append(f'pii_entities_total{{label="{label}"}} {self.entities[label]}')
+        lines += [
+            f"# HELP pii_throughput_utterances_per_second Utterances per second over the last {self.throughput_window:.0f}s.",
+            "# TYPE pii_throughput_utterances_per_second gauge",
+            f"pii_throughput_utterances_per_second {self.throughput():.3f}",
+            "# HELP pii_uptime_seconds Seconds since the metrics were created.",
+            "# TYPE pii_uptime_seconds gauge",
+            f"pii_uptime_seconds {time.time() - self.start_time:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace path with the current exposition (node_exporter textfile style)"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics from a daemon thread; returns the server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -5,10 +5,28 @@ import re
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 from labels import ID2LABEL, label_is_pii
 import os
+import time
+import shutil
+import numpy as np
+from metrics import InferenceMetrics
+from compiled import DEFAULT_BUCKETS, BucketedModel
+from dataset import pack_lengths, packed_attention_mask
+from fast_tokenizer import FastWordTokenizer
+from dedup_data import SPOKEN_DIGITS
 
-def validate_entity(text, start, end, label):
+# Minimum digit counts used by validate_entity; overridable for post-processing sweeps
+MIN_DIGITS = {"CREDIT_CARD": 12, "PHONE": 10}
+
+
+def count_digits(entity_text):
+    """Count written digits plus spoken digit words"""
+    return len(re.findall(r'\d', entity_text)) + sum(1 for w in entity_text.split() if w in SPOKEN_DIGITS)
+
+
+def validate_entity(text, start, end, label, min_digits=None):
     """Validate entity to reduce false positives and improve precision"""
     entity_text = text[start:end].lower()
+    min_digits = MIN_DIGITS if min_digits is None else min_digits
     
     # EMAIL validation
     if label == "EMAIL":
@@ -22,16 +40,14 @@ def validate_entity(text, start, end, label):
     # CREDIT_CARD validation
     elif label == "CREDIT_CARD":
         # Count digits (including spoken numbers)
-        digits = re.findall(r'\d', entity_text)
         # Credit cards are 13-19 digits, be lenient for spoken form
-        if len(digits) < 12:
+        if count_digits(entity_text) < min_digits["CREDIT_CARD"]:
             return False
     
     # PHONE validation
     elif label == "PHONE":
-        digits = re.findall(r'\d', entity_text)
         # Phone numbers are typically 10+ digits
-        if len(digits) < 10:
+        if count_digits(entity_text) < min_digits["PHONE"]:
             return False
     
     # DATE validation
@@ -102,6 +118,155 @@ def bio_to_spans(text, offsets, label_ids):
     return filtered
 
 
+def predict_logits(model, tokenizer, texts, max_length, device, metrics=None):
+    """Run the model over texts; returns (offsets, logits) per text with padding removed"""
+    t0 = time.perf_counter()
+    enc = tokenizer(
+        texts,
+        return_offsets_mapping=True,
+        truncation=True,
+        max_length=max_length,
+        padding=len(texts) > 1,
+        return_tensors="pt",
+    )
+    offsets = enc["offset_mapping"].tolist()
+    lengths = enc["attention_mask"].sum(dim=1).tolist()
+    input_ids = enc["input_ids"].to(device)
+    attention_mask = enc["attention_mask"].to(device)
+    t1 = time.perf_counter()
+
+    with torch.no_grad():
+        out = model(input_ids=input_ids, attention_mask=attention_mask)
+        logits = out.logits.float().cpu()
+
+    if metrics is not None:
+        metrics.observe_stage("tokenize", t1 - t0)
+        metrics.observe_stage("forward", time.perf_counter() - t1)
+    return [(offs[:n], row[:n]) for offs, row, n in zip(offsets, logits, lengths)]
+
+
+def predict_logits_packed(model, tokenizer, texts, max_length, device):
+    """
+    Like predict_logits, but the texts (e.g. the turns of one call) are packed into as few
+    max_length rows as fit and run as one batch. Position ids restart per text and attention
+    is block-diagonal, so no text attends to another; offsets stay relative to each text.
+    """
+    if not texts:
+        return []
+    enc = tokenizer(texts, return_offsets_mapping=True, truncation=True, max_length=max_length)
+    lengths = [len(ids) for ids in enc["input_ids"]]
+    bins = pack_lengths(lengths, max_length)
+    width = max(sum(lengths[i] for i in members) for members in bins)
+    input_ids = torch.full((len(bins), width), tokenizer.pad_token_id, dtype=torch.long)
+    position_ids = torch.zeros_like(input_ids)
+    segment_ids = torch.zeros_like(input_ids)
+    slots = [None] * len(texts)
+    for row, members in enumerate(bins):
+        col = 0
+        for seg, i in enumerate(members, start=1):
+            n = lengths[i]
+            input_ids[row, col:col + n] = torch.tensor(enc["input_ids"][i])
+            position_ids[row, col:col + n] = torch.arange(n)
+            segment_ids[row, col:col + n] = seg
+            slots[i] = (row, col, n)
+            col += n
+
+    with torch.no_grad():
+        out = model(
+            input_ids=input_ids.to(device),
+            attention_mask=packed_attention_mask(segment_ids).to(device),
+            position_ids=position_ids.to(device),
+        )
+        logits = out.logits.float().cpu()
+    return [(enc["offset_mapping"][i], logits[row, col:col + n]) for i, (row, col, n) in enumerate(slots)]
+
+
+def decode_logits(text, offsets, logits, min_confidence=None):
+    """Argmax decoding; tokens whose entity label is below its min_confidence become O"""
+    if not min_confidence:
+        return bio_to_spans(text, offsets, logits.argmax(dim=-1).tolist())
+    probs = torch.softmax(logits.float(), dim=-1)
+    conf, pred = probs.max(dim=-1)
+    pred_ids = []
+    for lid, p in zip(pred.tolist(), conf.tolist()):
+        label = ID2LABEL.get(lid, "O")
+        if label != "O" and p < min_confidence.get(label.split("-", 1)[1], 0.0):
+            lid = 0
+        pred_ids.append(lid)
+    return bio_to_spans(text, offsets, pred_ids)
+
+
+def predict_spans(model, tokenizer, text, max_length, device, min_confidence=None):
+    """Tag one utterance and return its (start, end, label) spans before validation"""
+    offsets, logits = predict_logits(model, tokenizer, [text], max_length, device)[0]
+    return decode_logits(text, offsets, logits, min_confidence)
+
+
+def predict_spans_batch(model, tokenizer, texts, max_length, device, min_confidence=None):
+    """Tag a padded batch of utterances; returns one span list per text"""
+    return [
+        decode_logits(text, offsets, logits, min_confidence)
+        for text, (offsets, logits) in zip(texts, predict_logits(model, tokenizer, texts, max_length, device))
+    ]
+
+
+class LogitsWriter:
+    """Append per-token logits and offsets batch by batch; close() writes memory-mappable .npy arrays"""
+
+    def __init__(self, path, dtype="float16"):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.num_labels = len(ID2LABEL)
+        self.lengths = []
+        self.logits = open(os.path.join(path, "logits.tmp"), "wb")
+        self.offsets = open(os.path.join(path, "offsets.tmp"), "wb")
+
+    def write(self, outputs):
+        for offs, row in outputs:
+            self.num_labels = row.shape[-1]
+            self.logits.write(row.numpy().astype(self.dtype).tobytes())
+            self.offsets.write(np.array(offs, dtype=np.int32).reshape(-1, 2).tobytes())
+            self.lengths.append(len(offs))
+
+    def _finish(self, tmp, name, dtype, width):
+        # Prepend an .npy header to the raw rows now that the total token count is known
+        tmp.close()
+        with open(os.path.join(self.path, f"{name}.npy"), "wb") as out, open(tmp.name, "rb") as raw:
+            header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                      "shape": (sum(self.lengths), width)}
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out)
+        os.remove(tmp.name)
+
+    def close(self, records):
+        self._finish(self.logits, "logits", self.dtype, self.num_labels)
+        self._finish(self.offsets, "offsets", np.dtype(np.int32), 2)
+        np.save(os.path.join(self.path, "index.npy"), np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64))
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"ids": [r["id"] for r in records], "texts": [r["text"] for r in records], "dtype": self.dtype.name},
+                f, ensure_ascii=False,
+            )
+
+
+def spans_to_entities(text, spans, min_digits=None):
+    """Keep spans that pass validate_entity and convert them to output records"""
+    ents = []
+    for s, e, lab in spans:
+        # Validate entity to improve precision
+        if validate_entity(text, s, e, lab, min_digits):
+            ents.append(
+                {
+                    "start": int(s),
+                    "end": int(e),
+                    "label": lab,
+                    "pii": bool(label_is_pii(lab)),
+                }
+            )
+    return ents
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_dir", default="out")
@@ -109,68 +274,107 @@ def main():
     ap.add_argument("--input", default="data/dev.jsonl")
     ap.add_argument("--output", default="out/dev_pred.json")
     ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--batch_size", type=int, default=None,
+                    help="Utterances per forward pass (default: --serving_config's, else 1)")
+    ap.add_argument("--dump_logits", default=None, help="Also write per-token logits and offsets to this directory")
+    ap.add_argument("--dump_dtype", default="float16", choices=["float16", "float32"],
+                    help="Logit precision for --dump_logits; float32 replays decoding exactly")
+    ap.add_argument("--postproc", default=None, help="JSON with min_digits / min_confidence from sweep_postproc.py")
+    ap.add_argument("--serving_config", default=None, help="JSON with batch_size / num_threads from autotune.py")
+    ap.add_argument("--metrics_file", default=None, help="Write Prometheus text metrics to this file")
+    ap.add_argument("--metrics_port", type=int, default=None, help="Serve Prometheus metrics on localhost:PORT/metrics")
+    ap.add_argument("--metrics_every", type=int, default=50, help="Rewrite --metrics_file every N batches")
+    ap.add_argument("--compile", default="none", choices=["none", "trace", "compile"],
+                    help="Run a TorchScript trace or torch.compile graph per length bucket")
+    ap.add_argument("--buckets", nargs="+", type=int, default=list(DEFAULT_BUCKETS), help="Padded lengths for --compile")
+    ap.add_argument("--fast_tokenizer", action="store_true", help="Tokenize with the memoized word-level FastWordTokenizer")
     ap.add_argument(
         "--device", default="cuda" if torch.cuda.is_available() else "cpu")
     args = ap.parse_args()
 
+    if args.serving_config:
+        with open(args.serving_config, "r", encoding="utf-8") as f:
+            serving = json.load(f)
+        # An explicit --batch_size wins over the tuned one
+        if args.batch_size is None:
+            args.batch_size = serving["batch_size"]
+        torch.set_num_threads(serving["num_threads"])
+    if args.batch_size is None:
+        args.batch_size = 1
+
     tokenizer = AutoTokenizer.from_pretrained(
         args.model_dir if args.model_name is None else args.model_name)
+    if args.fast_tokenizer:
+        tokenizer = FastWordTokenizer(tokenizer)
     model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
     model.to(args.device)
     model.eval()
 
-    results = {}
-
+    records = []
     with open(args.input, "r", encoding="utf-8") as f:
         for line in f:
-            obj = json.loads(line)
-            text = obj["text"]
-            uid = obj["id"]
-
-            enc = tokenizer(
-                text,
-                return_offsets_mapping=True,
-                truncation=True,
-                max_length=args.max_length,
-                return_tensors="pt",
-            )
-            offsets = enc["offset_mapping"][0].tolist()
-            input_ids = enc["input_ids"].to(args.device)
-            attention_mask = enc["attention_mask"].to(args.device)
-
-            with torch.no_grad():
-                out = model(input_ids=input_ids, attention_mask=attention_mask)
-                logits = out.logits[0]
-                pred_ids = logits.argmax(dim=-1).cpu().tolist()
-
-            spans = bio_to_spans(text, offsets, pred_ids)
-            ents = []
-            for s, e, lab in spans:
-                ents.append(
-                    {
-                        "start": int(s),
-                        "end": int(e),
-                        "label": lab,
-                        "pii": bool(label_is_pii(lab)),
-                    }
-                )
-                # Validate entity to improve precision
-                if validate_entity(text, s, e, lab):
-                    ents.append(
-                        {
-                            "start": int(s),
-                            "end": int(e),
-                            "label": lab,
-                            "pii": bool(label_is_pii(lab)),
-                        }
-                    )
-            results[uid] = ents
+            records.append(json.loads(line))
+
+    if args.compile != "none":
+        model = BucketedModel(model, args.buckets, args.compile, tokenizer.pad_token_id)
+        # Warm the final partial batch too so it does not trigger a trace/compile mid-run
+        batch_sizes = sorted({min(args.batch_size, len(records)), len(records) % args.batch_size} - {0})
+        for (batch_size, bucket), ms in model.warmup(batch_sizes=batch_sizes).items():
+            print(f"Warmed {args.compile} bucket {bucket:4d} (batch {batch_size}): {ms:.2f} ms")
+
+    min_digits, min_confidence = None, None
+    if args.postproc:
+        with open(args.postproc, "r", encoding="utf-8") as f:
+            postproc = json.load(f)
+        min_digits = postproc.get("min_digits")
+        min_confidence = postproc.get("min_confidence")
+
+    metrics = None
+    if args.metrics_file or args.metrics_port:
+        metrics = InferenceMetrics()
+        if args.metrics_port:
+            metrics.serve(args.metrics_port)
+            print(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    results = {}
+    dump = LogitsWriter(args.dump_logits, args.dump_dtype) if args.dump_logits else None
+    for batch_no, i in enumerate(range(0, len(records), args.batch_size)):
+        start = time.perf_counter()
+        chunk = records[i:i + args.batch_size]
+        texts = [obj["text"] for obj in chunk]
+        outputs = predict_logits(model, tokenizer, texts, args.max_length, args.device, metrics)
+        if dump is not None:
+            dump.write(outputs)
+        decode_start = time.perf_counter()
+        for obj, (offsets, logits) in zip(chunk, outputs):
+            spans = decode_logits(obj["text"], offsets, logits, min_confidence)
+            results[obj["id"]] = spans_to_entities(obj["text"], spans, min_digits)
+            if metrics is not None:
+                metrics.observe_entities(results[obj["id"]])
+
+        if metrics is not None:
+            end = time.perf_counter()
+            metrics.observe_stage("decode", end - decode_start)
+            truncated = sum(1 for offsets, _ in outputs if len(offsets) >= args.max_length)
+            metrics.observe_batch(len(chunk), end - start, truncated)
+            if args.metrics_file and (batch_no + 1) % args.metrics_every == 0:
+                metrics.write(args.metrics_file)
+
+    if dump is not None:
+        dump.close(records)
+        print(f"Wrote logits for {len(dump.lengths)} utterances to {args.dump_logits}")
 
     os.makedirs(os.path.dirname(args.output), exist_ok=True)
     with open(args.output, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
 
     print(f"Wrote predictions for {len(results)} utterances to {args.output}")
+    if args.fast_tokenizer:
+        stats = tokenizer.stats()
+        print(f"Tokenizer cache hit rate: {100.0 * stats['hit_rate']:.1f}% over {stats['word_lookups']} words")
+    if metrics is not None and args.metrics_file:
+        metrics.write(args.metrics_file)
+        print(f"Wrote metrics to {args.metrics_file}")
 
 
 if __name__ == "__main__":
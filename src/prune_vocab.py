@@ -0,0 +1,132 @@
+"""
+Shrink a trained model's WordPiece vocabulary and embedding matrix to the
+tokens actually used by a corpus.
+
+Every token produced when tokenizing the corpus is kept, together with the
+special tokens and all single ASCII characters (plain and ## continuation) so
+unseen words still decompose into characters instead of collapsing to [UNK].
+WordPiece is greedy longest-match-first, so any word from the corpus is split
+exactly as before with the reduced vocabulary.
+"""
+import os
+import json
+import time
+import argparse
+from collections import Counter
+
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from train import evaluate
+
+
+def read_texts(path):
+    """Yield texts from a JSONL file with a "text" field or a plain text file (one per line)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                yield json.loads(line)["text"]
+            else:
+                yield line
+
+
+def is_fallback_token(token):
+    char = token[2:] if token.startswith("##") else token
+    return len(char) == 1 and char.isascii() and char.isprintable()
+
+
+def dir_size_mb(path):
+    total = 0
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            total += os.path.getsize(full)
+    return total / (1024 * 1024)
+
+
+def timed_load(model_dir):
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForTokenClassification.from_pretrained(model_dir)
+    return tokenizer, model, (time.perf_counter() - start) * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--extra", nargs="*", default=[], help="Additional JSONL or plain text files to cover")
+    ap.add_argument("--min_count", type=int, default=1, help="Drop corpus tokens seen fewer times than this")
+    ap.add_argument("--out_dir", default="out_pruned")
+    ap.add_argument("--dev", default="data/dev.jsonl", help="Scored with both models to report the F1 change")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer, model, load_ms = timed_load(args.model_dir)
+    old_params = sum(p.numel() for p in model.parameters())
+    vocab = tokenizer.get_vocab()
+
+    counts = Counter()
+    num_texts = 0
+    for path in [args.train] + args.extra:
+        for text in read_texts(path):
+            counts.update(tokenizer(text, add_special_tokens=False)["input_ids"])
+            num_texts += 1
+
+    keep = set(tokenizer.all_special_ids)
+    keep.update(i for i, c in counts.items() if c >= args.min_count)
+    keep.update(i for tok, i in vocab.items() if is_fallback_token(tok))
+    kept_ids = sorted(keep)
+    id_to_token = {i: tok for tok, i in vocab.items()}
+    print(f"Scanned {num_texts} texts: {len(counts)} distinct tokens used, keeping {len(kept_ids)} of {len(vocab)}")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    vocab_path = os.path.join(args.out_dir, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        for i in kept_ids:
+            f.write(id_to_token[i] + "\n")
+    new_tokenizer = type(tokenizer)(vocab_path, do_lower_case=getattr(tokenizer, "do_lower_case", True))
+    new_tokenizer.model_max_length = tokenizer.model_max_length
+
+    old_emb = model.get_input_embeddings().weight.data
+    index = torch.tensor(kept_ids, dtype=torch.long)
+    model.resize_token_embeddings(len(kept_ids))
+    model.get_input_embeddings().weight.data.copy_(old_emb[index])
+    model.config.vocab_size = len(kept_ids)
+    model.config.pad_token_id = new_tokenizer.pad_token_id
+
+    model.save_pretrained(args.out_dir)
+    new_tokenizer.save_pretrained(args.out_dir)
+
+    mismatched = 0
+    for text in read_texts(args.train):
+        old_ids = tokenizer(text)["input_ids"]
+        new_ids = new_tokenizer(text)["input_ids"]
+        if [id_to_token[i] for i in old_ids] != new_tokenizer.convert_ids_to_tokens(new_ids):
+            mismatched += 1
+    print(f"Tokenization mismatches on {args.train}: {mismatched}")
+
+    new_tokenizer, new_model, new_load_ms = timed_load(args.out_dir)
+    new_params = sum(p.numel() for p in new_model.parameters())
+
+    print(f"Parameters: {old_params / 1e6:.1f}M -> {new_params / 1e6:.1f}M")
+    print(f"On-disk size: {dir_size_mb(args.model_dir):.1f} MB -> {dir_size_mb(args.out_dir):.1f} MB")
+    print(f"Load time: {load_ms:.0f} ms -> {new_load_ms:.0f} ms")
+
+    if args.dev and os.path.exists(args.dev):
+        old_model = AutoModelForTokenClassification.from_pretrained(args.model_dir).to(args.device)
+        before = evaluate(old_model, tokenizer, args.dev, args.max_length, args.device)
+        after = evaluate(new_model.to(args.device), new_tokenizer, args.dev, args.max_length, args.device)
+        print(
+            f"Dev Macro-F1: {before['macro_f1']:.3f} -> {after['macro_f1']:.3f}  "
+            f"PII-F1: {before['pii'][2]:.3f} -> {after['pii'][2]:.3f}"
+        )
+    print(f"Saved pruned model + tokenizer to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Incremental tagging of growing partial STT hypotheses.
+
+Each session remembers the spans it has already finalized and the character
+position up to which the transcript is considered stable. An update only
+re-tags the text after that position plus `context_chars` of left context,
+so the cost per update depends on the unstable tail, not the whole prefix.
+All offsets refer to the full transcript.
+
+Final spans can differ from tagging the whole transcript at once either
+because the model sees less context in a window (context) or because of how
+windows are merged (merge). The script checks every update: a valid span
+the window predicted that reaches past the stable position must be in the
+update's output, otherwise merging lost it. Differences from transcripts
+where no update lost a span come from context.
+"""
+import json
+import time
+import argparse
+
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from labels import label_is_pii
+from predict import bio_to_spans, predict_spans, validate_entity
+
+
+def word_start_at_or_before(text, pos):
+    """Largest index <= pos that starts a word (or 0)"""
+    pos = max(0, min(pos, len(text)))
+    while pos > 0 and not (text[pos - 1].isspace() and (pos == len(text) or not text[pos].isspace())):
+        pos -= 1
+    return pos
+
+
+def word_start_at_or_after(text, pos):
+    """Smallest index >= pos that starts a word (or len(text))"""
+    pos = max(0, pos)
+    while pos < len(text) and pos > 0 and not (text[pos - 1].isspace() and not text[pos].isspace()):
+        pos += 1
+    return min(pos, len(text))
+
+
+def common_prefix_len(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def to_entities(spans):
+    return [
+        {"start": int(s), "end": int(e), "label": lab, "pii": bool(label_is_pii(lab))}
+        for s, e, lab in spans
+    ]
+
+
+class TaggingSession:
+    def __init__(self):
+        self.text = ""
+        self.finalized = []
+        self.stable_pos = 0
+
+
+class IncrementalTagger:
+    def __init__(self, model, tokenizer, max_length=256, device="cpu", context_chars=48, holdback_chars=32):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.device = device
+        self.context_chars = context_chars
+        self.holdback_chars = holdback_chars
+        self.sessions = {}
+        self.chars_tagged = 0
+
+    def _tag(self, text, window_start):
+        """Return (spans, covered_end) for text[window_start:]; covered_end < len(text) on truncation"""
+        window = text[window_start:]
+        enc = self.tokenizer(
+            window,
+            return_offsets_mapping=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        offsets = enc["offset_mapping"][0].tolist()
+        with torch.no_grad():
+            logits = self.model(
+                input_ids=enc["input_ids"].to(self.device),
+                attention_mask=enc["attention_mask"].to(self.device),
+            ).logits[0]
+        pred_ids = logits.argmax(dim=-1).cpu().tolist()
+        covered = max((e for _, e in offsets), default=0)
+        if covered >= len(window.rstrip()):
+            covered = len(window)
+        spans = [(s + window_start, e + window_start, lab) for s, e, lab in bio_to_spans(window, offsets, pred_ids)]
+        return spans, window_start + covered
+
+    def update(self, session_id, text, final=False):
+        """Tag the latest transcript of a session and return all entities so far"""
+        sess = self.sessions.setdefault(session_id, TaggingSession())
+
+        # STT may revise earlier words: roll back anything past the first change
+        lcp = common_prefix_len(sess.text, text)
+        if lcp < sess.stable_pos:
+            sess.stable_pos = word_start_at_or_before(text, lcp)
+            sess.finalized = [sp for sp in sess.finalized if sp[1] <= sess.stable_pos]
+        sess.text = text
+
+        window_start = min(sess.stable_pos, word_start_at_or_after(text, sess.stable_pos - self.context_chars))
+        spans, covered_end = self._tag(text, window_start)
+        self.chars_tagged += len(text) - window_start
+
+        # A span that starts in the stable region but runs past it (e.g. "ring road" finalized as O,
+        # then "ring road kolkata" tagged LOCATION) reopens the stable region from its start
+        crossing = [sp for sp in spans if sp[0] < sess.stable_pos < sp[1]]
+        while crossing:
+            sess.stable_pos = word_start_at_or_before(text, min(sp[0] for sp in crossing))
+            crossing = [sp for sp in spans if sp[0] < sess.stable_pos < sp[1]]
+        sess.finalized = [sp for sp in sess.finalized if sp[1] <= sess.stable_pos]
+        fresh = [sp for sp in spans if sp[0] >= sess.stable_pos]
+
+        # Advance the stable region to a word boundary that no fresh span crosses
+        limit = covered_end if final else min(covered_end, len(text) - self.holdback_chars)
+        candidate = len(text) if final and covered_end >= len(text) else word_start_at_or_before(text, limit)
+        crossing = [sp for sp in fresh if sp[0] < candidate < sp[1]]
+        while crossing:
+            candidate = word_start_at_or_before(text, min(sp[0] for sp in crossing))
+            crossing = [sp for sp in fresh if sp[0] < candidate < sp[1]]
+
+        if candidate > sess.stable_pos:
+            sess.finalized.extend(
+                sp for sp in fresh if sp[1] <= candidate and validate_entity(text, *sp)
+            )
+            sess.stable_pos = candidate
+
+        provisional = [sp for sp in fresh if sp[0] >= sess.stable_pos and validate_entity(text, *sp)]
+        return to_entities(sess.finalized + provisional)
+
+    def finish(self, session_id, text=None):
+        """Finalize and drop a session, returning its entities; a transcript with no partials is tagged in one go"""
+        sess = self.sessions.get(session_id)
+        if sess is None and text is None:
+            return []
+        ents = self.update(session_id, sess.text if text is None else text, final=True)
+        del self.sessions[session_id]
+        return ents
+
+
+class RecordingTagger(IncrementalTagger):
+    """IncrementalTagger that remembers the spans its latest window predicted"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.window_spans = []
+
+    def _tag(self, text, window_start):
+        spans, covered_end = super()._tag(text, window_start)
+        self.window_spans = spans
+        return spans, covered_end
+
+
+def lost_spans(tagger, text, stable_pos, ents):
+    """Valid spans of the latest window reaching past stable_pos that the update did not return"""
+    got = {(e["start"], e["end"], e["label"]) for e in ents}
+    return [sp for sp in tagger.window_spans if sp[1] > stable_pos and validate_entity(text, *sp) and sp not in got]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--model_name", default=None)
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--words_per_update", type=int, default=1, help="Words added to the hypothesis per update")
+    ap.add_argument("--utterances_per_transcript", type=int, default=1,
+                    help="Join this many consecutive utterances into one transcript")
+    ap.add_argument("--context_chars", type=int, default=48)
+    ap.add_argument("--holdback_chars", type=int, default=32)
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
+    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
+    model.to(args.device)
+    model.eval()
+    tagger = RecordingTagger(
+        model, tokenizer, args.max_length, args.device,
+        context_chars=args.context_chars, holdback_chars=args.holdback_chars,
+    )
+
+    texts = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            texts.append(json.loads(line)["text"])
+    n = args.utterances_per_transcript
+    texts = [" ".join(texts[i:i + n]) for i in range(0, len(texts), n)]
+
+    inc_ms = full_ms = 0.0
+    full_chars = 0
+    updates = agree = context_diffs = merge_diffs = 0
+    for uid, text in enumerate(texts):
+        lost = []
+        words = text.split(" ")
+        prefixes = [
+            " ".join(words[:i]) for i in range(args.words_per_update, len(words), args.words_per_update)
+        ] + [text]
+
+        for prefix in prefixes[:-1]:
+            stable_pos = tagger.sessions[uid].stable_pos if uid in tagger.sessions else 0
+            start = time.perf_counter()
+            ents = tagger.update(uid, prefix)
+            inc_ms += (time.perf_counter() - start) * 1000.0
+            lost += lost_spans(tagger, prefix, stable_pos, ents)
+            start = time.perf_counter()
+            predict_spans(model, tokenizer, prefix, args.max_length, args.device)
+            full_ms += (time.perf_counter() - start) * 1000.0
+            full_chars += len(prefix)
+        stable_pos = tagger.sessions[uid].stable_pos if uid in tagger.sessions else 0
+        start = time.perf_counter()
+        ents = tagger.finish(uid, text)
+        inc_ms += (time.perf_counter() - start) * 1000.0
+        lost += lost_spans(tagger, text, stable_pos, ents)
+        updates += len(prefixes)
+
+        start = time.perf_counter()
+        full = predict_spans(model, tokenizer, text, args.max_length, args.device)
+        full_ms += (time.perf_counter() - start) * 1000.0
+        full_chars += len(text)
+        ref = to_entities([sp for sp in full if validate_entity(text, *sp)])
+        agree += int(ents == ref)
+        if ents != ref and not lost:
+            context_diffs += 1
+        elif ents != ref:
+            merge_diffs += 1
+            if merge_diffs <= 3:
+                print(f"MERGE LOSS: {text[:80]!r}\n    window spans dropped by merging: {lost}")
+
+    print(f"Utterances: {len(texts)}  updates: {updates}")
+    print(f"Full re-tagging:   {full_ms:.1f} ms total, {full_chars} chars tagged")
+    print(f"Incremental:       {inc_ms:.1f} ms total, {tagger.chars_tagged} chars tagged")
+    print(f"Final spans identical to full-text tagging: {agree}/{len(texts)}")
+    print(f"  differing because a window's context changed the prediction: {context_diffs}")
+    print(f"  differing with spans lost by merging: {merge_diffs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Parallel hyperparameter sweep over train.py settings.
+
+The training set is tokenized once per (model_name, max_length) pair and
+written with dataset.save_tokenized(); every trial memory-maps that copy
+read-only. Trials train in parallel worker processes, each limited to
+--threads_per_trial intra-op threads. Latency is measured afterwards, one
+trial at a time, so trials do not distort each other's timings. The
+Pareto-optimal configurations on (dev PII F1, p95 latency) are written to
+pareto.tsv in --sweep_dir.
+"""
+import os
+import json
+import argparse
+import itertools
+import multiprocessing as mp
+
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from dataset import PIIDataset, save_tokenized
+from labels import LABELS
+from measure_latency import measure
+from train import parse_args as train_parse_args, train
+
+SWEEP_PARAMS = ["model_name", "lr", "pii_weight", "batch_size", "max_length"]
+
+
+def run_trial(trial):
+    torch.set_num_threads(trial["threads"])
+    args = train_parse_args(trial["argv"])
+    metrics = train(args)
+    return {
+        "trial": trial["name"],
+        "config": trial["config"],
+        "out_dir": args.out_dir,
+        "macro_f1": metrics["macro_f1"],
+        "pii_f1": metrics["pii"][2],
+    }
+
+
+def pareto_front(results):
+    """Results not dominated on (higher pii_f1, lower p95_ms)"""
+    front = []
+    for r in results:
+        dominated = any(
+            o["pii_f1"] >= r["pii_f1"] and o["p95_ms"] <= r["p95_ms"]
+            and (o["pii_f1"] > r["pii_f1"] or o["p95_ms"] < r["p95_ms"])
+            for o in results
+        )
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r["p95_ms"])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--sweep_dir", default="sweeps")
+    ap.add_argument("--model_name", nargs="+", default=["distilbert-base-uncased"])
+    ap.add_argument("--lr", nargs="+", type=float, default=[5e-5])
+    ap.add_argument("--pii_weight", nargs="+", type=float, default=[2.0])
+    ap.add_argument("--batch_size", nargs="+", type=int, default=[16])
+    ap.add_argument("--max_length", nargs="+", type=int, default=[256])
+    ap.add_argument("--epochs", type=int, default=50)
+    ap.add_argument("--parallel", type=int, default=2, help="Trials trained at the same time")
+    ap.add_argument("--threads_per_trial", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    ap.add_argument("--latency_runs", type=int, default=50)
+    ap.add_argument("--latency_threads", type=int, default=1, help="torch threads while measuring latency")
+    args = ap.parse_args()
+    os.makedirs(args.sweep_dir, exist_ok=True)
+
+    # Tokenize once per distinct tokenizer/max_length and share the result
+    caches = {}
+    for model_name, max_length in itertools.product(args.model_name, args.max_length):
+        cache_dir = os.path.join(args.sweep_dir, f"tokenized_{len(caches)}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        save_tokenized(PIIDataset(args.train, tokenizer, LABELS, max_length=max_length), cache_dir)
+        caches[(model_name, max_length)] = cache_dir
+
+    trials = []
+    for values in itertools.product(*(getattr(args, p) for p in SWEEP_PARAMS)):
+        config = dict(zip(SWEEP_PARAMS, values))
+        name = f"trial_{len(trials):03d}"
+        argv = [
+            "--dev", args.dev,
+            "--out_dir", os.path.join(args.sweep_dir, name),
+            "--epochs", str(args.epochs),
+            "--tokenized_train", caches[(config["model_name"], config["max_length"])],
+            "--device", "cpu",
+        ]
+        for p in SWEEP_PARAMS:
+            argv += [f"--{p}", str(config[p])]
+        trials.append({"name": name, "config": config, "argv": argv, "threads": args.threads_per_trial})
+    print(f"Running {len(trials)} trials, {args.parallel} at a time with {args.threads_per_trial} threads each")
+
+    os.environ["OMP_NUM_THREADS"] = str(args.threads_per_trial)
+    os.environ["MKL_NUM_THREADS"] = str(args.threads_per_trial)
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes=args.parallel, maxtasksperchild=1) as pool:
+        results = pool.map(run_trial, trials, chunksize=1)
+
+    dev_texts = []
+    with open(args.dev, "r", encoding="utf-8") as f:
+        for line in f:
+            dev_texts.append(json.loads(line)["text"])
+
+    torch.set_num_threads(args.latency_threads)
+    for r in results:
+        tokenizer = AutoTokenizer.from_pretrained(r["out_dir"])
+        model = AutoModelForTokenClassification.from_pretrained(r["out_dir"])
+        model.eval()
+        r["p50_ms"], r["p95_ms"] = measure(
+            model, tokenizer, dev_texts, r["config"]["max_length"], args.latency_runs, "cpu"
+        )
+
+    with open(os.path.join(args.sweep_dir, "results.jsonl"), "w", encoding="utf-8") as f:
+        for r in results:
+            f.write(json.dumps(r) + "\n")
+
+    front = pareto_front(results)
+    header = ["trial"] + SWEEP_PARAMS + ["pii_f1", "macro_f1", "p95_ms"]
+    rows = [
+        [r["trial"]] + [str(r["config"][p]) for p in SWEEP_PARAMS]
+        + [f"{r['pii_f1']:.3f}", f"{r['macro_f1']:.3f}", f"{r['p95_ms']:.2f}"]
+        for r in front
+    ]
+    with open(os.path.join(args.sweep_dir, "pareto.tsv"), "w", encoding="utf-8") as f:
+        for row in [header] + rows:
+            f.write("\t".join(row) + "\n")
+
+    print(f"\nPareto-optimal configurations ({len(front)} of {len(results)}):")
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+    print(f"\nWrote {os.path.join(args.sweep_dir, 'pareto.tsv')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Offline post-processing sweep over logits dumped by `predict.py --dump_logits`.
+
+Decoding is replayed from the stored logits, so trying a new digit-count
+minimum or per-label confidence threshold costs a few milliseconds per
+setting instead of a model pass over the dev set. Digit minimums and one
+global confidence threshold are searched on a grid, then each label's
+threshold is refined in turn around the best setting.
+
+Replay is exact only for a float32 dump (`--dump_dtype float32`). The
+default float16 dump rounds the logits, which can flip an argmax or a
+confidence comparison on a few utterances, so float16 scores are a close
+approximation of a live run, not a bit-for-bit match.
+"""
+import os
+import json
+import argparse
+import itertools
+
+import numpy as np
+import torch
+
+from eval_span_f1 import load_gold, span_f1
+from labels import LABELS
+from predict import MIN_DIGITS, decode_logits, spans_to_entities
+
+
+def load_logits(path):
+    logits = np.load(os.path.join(path, "logits.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+    index = np.load(os.path.join(path, "index.npy"))
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    records = []
+    for i, (uid, text) in enumerate(zip(meta["ids"], meta["texts"])):
+        start, end = int(index[i]), int(index[i + 1])
+        records.append(
+            (uid, text, offsets[start:end].tolist(), torch.from_numpy(np.array(logits[start:end], dtype=np.float32)))
+        )
+    return records, logits.dtype
+
+
+def score(records, gold, min_digits, min_confidence):
+    pred = {}
+    for uid, text, offsets, logits in records:
+        spans = decode_logits(text, offsets, logits, min_confidence)
+        pred[uid] = [(e["start"], e["end"], e["label"]) for e in spans_to_entities(text, spans, min_digits)]
+    return span_f1(gold, pred)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logits", default="out/dev_logits")
+    ap.add_argument("--gold", default="data/dev.jsonl")
+    ap.add_argument("--cc_min_digits", nargs="+", type=int, default=[8, 10, 12, 13, 14])
+    ap.add_argument("--phone_min_digits", nargs="+", type=int, default=[6, 8, 9, 10])
+    ap.add_argument("--min_confidence", nargs="+", type=float, default=[0.0, 0.3, 0.5, 0.7, 0.9])
+    ap.add_argument("--metric", default="pii", choices=["pii", "macro"], help="Objective: PII-only F1 or macro F1")
+    ap.add_argument("--output", default="out/postproc.json", help="Best setting, usable as predict.py --postproc")
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args()
+
+    records, dtype = load_logits(args.logits)
+    gold = load_gold(args.gold)
+    entity_types = sorted({l.split("-", 1)[1] for l in LABELS if l != "O"})
+
+    def objective(m):
+        return m["pii"][2] if args.metric == "pii" else m["macro_f1"]
+
+    baseline = score(records, gold, MIN_DIGITS, None)
+    results = []
+    for cc, phone, conf in itertools.product(args.cc_min_digits, args.phone_min_digits, args.min_confidence):
+        min_digits = {"CREDIT_CARD": cc, "PHONE": phone}
+        min_confidence = {t: conf for t in entity_types} if conf > 0 else None
+        m = score(records, gold, min_digits, min_confidence)
+        results.append((objective(m), m, min_digits, min_confidence))
+    results.sort(key=lambda r: -r[0])
+
+    best_value, best_metrics, best_digits, best_conf = results[0]
+    best_conf = dict(best_conf or {t: 0.0 for t in entity_types})
+    for t in entity_types:
+        for thr in args.min_confidence:
+            trial = dict(best_conf, **{t: thr})
+            m = score(records, gold, best_digits, trial)
+            if objective(m) > best_value:
+                best_value, best_metrics, best_conf = objective(m), m, trial
+
+    print(f"Replayed {len(records)} utterances, {len(results)} grid settings + per-label refinement")
+    if dtype != np.float32:
+        print(f"Note: {dtype} logits, scores approximate a live run (dump with --dump_dtype float32 for exact replay)")
+    print(f"Baseline:  PII-F1={baseline['pii'][2]:.3f}  Macro-F1={baseline['macro_f1']:.3f}")
+    print(f"\nTop grid settings ({args.metric}):")
+    for value, m, digits, conf in results[:args.top]:
+        thr = max(conf.values()) if conf else 0.0
+        print(
+            f"  cc>={digits['CREDIT_CARD']:2d} phone>={digits['PHONE']:2d} conf>={thr:.2f}  "
+            f"PII-F1={m['pii'][2]:.3f}  Macro-F1={m['macro_f1']:.3f}"
+        )
+    print(f"\nBest after per-label refinement: PII-F1={best_metrics['pii'][2]:.3f}  Macro-F1={best_metrics['macro_f1']:.3f}")
+    print(f"  min_digits={best_digits}")
+    print(f"  min_confidence={best_conf}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"min_digits": best_digits, "min_confidence": best_conf}, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,39 @@
 import os
+import sys
+import copy
+import math
+import time
+import json
+import socket
 import argparse
+from contextlib import ExitStack
+from functools import partial
 import torch
-from torch.utils.data import DataLoader
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler
 from tqdm import tqdm
 from transformers import AutoTokenizer, get_linear_schedule_with_warmup
 
-from dataset import PIIDataset, collate_batch
+from dataset import (
+    HardExampleSampler,
+    PIIDataset,
+    PackedPIIDataset,
+    StreamingPIIDataset,
+    TokenizedPIIDataset,
+    collate_batch,
+    collate_packed_batch,
+)
 from labels import LABELS, label_is_pii
 from model import create_model
+from fast_tokenizer import FastWordTokenizer
+from feature_cache import build_feature_cache, collate_cached_batch, freeze_lower, truncated_encoder
+from predict import predict_spans, validate_entity
+from eval_span_f1 import load_gold, span_f1
 
 
-def parse_args():
+def parse_args(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_name", default="distilbert-base-uncased")
     ap.add_argument("--train", default="data/train.jsonl")
@@ -23,25 +46,162 @@ def parse_args():
     ap.add_argument("--weight_decay", type=float, default=0.01)
     ap.add_argument("--gradient_clip", type=float, default=1.0, help="Gradient clipping value")
     ap.add_argument("--pii_weight", type=float, default=2.0, help="Weight multiplier for PII entities")
+    ap.add_argument("--pack", action="store_true", help="Pack several utterances into each max_length sequence")
+    ap.add_argument("--compare_packing", action="store_true",
+                    help="Train unpacked and packed with the same settings and compare tokens/sec and dev F1")
+    ap.add_argument("--stream", action="store_true", help="Stream --train (file, glob or comma list of shards) from disk")
+    ap.add_argument("--shuffle_buffer", type=int, default=10000, help="Examples held for approximate shuffling with --stream")
+    ap.add_argument("--num_workers", type=int, default=0, help="DataLoader worker processes")
+    ap.add_argument("--tokenized_train", default=None, help="Directory written by dataset.save_tokenized; replaces --train")
+    ap.add_argument("--freeze_layers", type=int, default=0, help="Freeze embeddings and the lower N encoder layers")
+    ap.add_argument("--feature_cache", default=None, help="Cache frozen-layer outputs to this .npy file and train from it")
+    ap.add_argument("--cache_fp16", action="store_true", help="Store cached features as float16")
+    ap.add_argument("--curriculum", action="store_true", help="Train later epochs mostly on the highest-loss examples")
+    ap.add_argument("--hard_fraction", type=float, default=0.3, help="Share of highest-loss examples per curriculum epoch")
+    ap.add_argument("--replay_fraction", type=float, default=0.1, help="Random share of the remaining examples replayed")
+    ap.add_argument("--curriculum_warmup", type=int, default=2, help="Full-data epochs before selection starts")
+    ap.add_argument("--fast_tokenizer", action="store_true", help="Tokenize with the memoized word-level FastWordTokenizer")
+    ap.add_argument("--ranks", type=int, default=1, help="Data-parallel CPU processes (torch.distributed, gloo)")
+    ap.add_argument("--threads_per_rank", type=int, default=None, help="Intra-op threads per rank (default: cores / ranks)")
+    ap.add_argument("--scaling", action="store_true", help="Report samples/sec at 1, 2, 4, ... --ranks ranks instead of training")
+    ap.add_argument("--benchmark_steps", type=int, default=0,
+                    help="Stop after N steps per rank and return samples/sec without evaluating or saving")
     ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
-    return ap.parse_args()
+    return ap.parse_args(argv)
 
-def main():
-    args = parse_args()
+
+def evaluate(model, tokenizer, path, max_length, device):
+    """Predict spans for every utterance in path and score them against its gold entities"""
+    model.eval()
+    pred = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            obj = json.loads(line)
+            text = obj["text"]
+            pred[obj["id"]] = [
+                (s, e, lab)
+                for s, e, lab in predict_spans(model, tokenizer, text, max_length, device)
+                if validate_entity(text, s, e, lab)
+            ]
+    model.train()
+    return span_f1(load_gold(path), pred)
+
+
+def time_full_steps(model, dataset, batch_size, pad_token_id, device, steps=5):
+    """Average seconds per forward/backward step through the whole model"""
+    model.train()
+    dl = DataLoader(dataset, batch_size=batch_size, shuffle=False, collate_fn=partial(collate_batch, pad_token_id=pad_token_id))
+    timings = []
+    for i, batch in enumerate(dl):
+        if i >= steps:
+            break
+        start = time.perf_counter()
+        logits = model(
+            input_ids=torch.tensor(batch["input_ids"], device=device),
+            attention_mask=torch.tensor(batch["attention_mask"], device=device),
+        ).logits
+        logits.float().sum().backward()
+        timings.append(time.perf_counter() - start)
+    model.zero_grad(set_to_none=True)
+    return sum(timings) / max(1, len(timings))
+
+
+def train(args, rank=0, world_size=1):
+    """
+    Train a model as configured by args, save it to args.out_dir and return dev metrics (or None).
+    With world_size > 1 this is one rank of a gloo process group; only rank 0 evaluates and saves.
+    Dev metrics also carry the run's "tokens_per_sec". With --benchmark_steps it returns
+    {"samples_per_sec": ...} instead.
+    """
     os.makedirs(args.out_dir, exist_ok=True)
 
     tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length, is_train=True)
+    if args.fast_tokenizer:
+        tokenizer = FastWordTokenizer(tokenizer)
+    if args.stream and args.pack:
+        raise ValueError("--stream and --pack cannot be combined")
+    if world_size > 1:
+        if args.stream or args.curriculum or args.feature_cache:
+            raise ValueError("--ranks > 1 cannot be combined with --stream, --curriculum or --feature_cache")
+        if args.device != "cpu":
+            raise ValueError("--ranks > 1 uses the gloo backend and requires --device cpu")
+    if args.stream:
+        train_ds = StreamingPIIDataset(
+            args.train, tokenizer, LABELS, max_length=args.max_length, shuffle_buffer=args.shuffle_buffer
+        )
+        stream_steps = [train_ds.num_batches(args.batch_size, args.num_workers, e) for e in range(args.epochs)]
+        print(f"Streaming {len(train_ds.shards)} shard(s), {stream_steps[0]} steps per epoch")
+        collate_fn = collate_batch
+    else:
+        if args.tokenized_train:
+            train_ds = TokenizedPIIDataset(args.tokenized_train)
+        else:
+            train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length, is_train=True)
+        if args.pack:
+            train_ds = PackedPIIDataset(train_ds, max_length=args.max_length)
+            print(f"Packed {train_ds.num_utterances} utterances into {len(train_ds)} sequences")
+            collate_fn = collate_packed_batch
+        else:
+            collate_fn = collate_batch
+        steps_per_epoch = math.ceil(len(train_ds) / args.batch_size)
+
+    model = create_model(args.model_name)
+    model.to(args.device)
+
+    full_step_time = None
+    if args.feature_cache:
+        if args.stream or args.pack:
+            raise ValueError("--feature_cache cannot be combined with --stream or --pack")
+        if args.freeze_layers <= 0:
+            raise ValueError("--feature_cache requires --freeze_layers > 0")
+        full_step_time = time_full_steps(model, train_ds, args.batch_size, tokenizer.pad_token_id, args.device)
+    if args.freeze_layers > 0:
+        freeze_lower(model, args.freeze_layers)
+        print(f"Froze embeddings and the lower {args.freeze_layers} encoder layers")
+    cache_time = 0.0
+    if args.feature_cache:
+        start = time.perf_counter()
+        train_ds = build_feature_cache(
+            model, train_ds, args.freeze_layers, args.feature_cache, args.device, fp16=args.cache_fp16
+        )
+        cache_time = time.perf_counter() - start
+        collate_fn = collate_cached_batch
+        print(f"Cached lower-layer features for {len(train_ds)} utterances in {cache_time:.1f}s -> {args.feature_cache}")
+
+    sampler = None
+    if args.curriculum:
+        if args.stream or args.pack:
+            raise ValueError("--curriculum cannot be combined with --stream or --pack")
+        sampler = HardExampleSampler(
+            len(train_ds), args.hard_fraction, args.replay_fraction, args.curriculum_warmup
+        )
+        id_to_index = {train_ds[i]["id"]: i for i in range(len(train_ds))}
+        epoch_steps = [math.ceil(sampler.epoch_size(e) / args.batch_size) for e in range(args.epochs)]
+    elif args.stream:
+        epoch_steps = stream_steps
+    else:
+        epoch_steps = [steps_per_epoch] * args.epochs
+
+    # Each rank trains on its own shard; DDP all-reduces gradients and broadcasts rank 0's initial weights
+    dist_sampler = None
+    forward_model = model
+    if world_size > 1:
+        dist_sampler = DistributedSampler(train_ds, num_replicas=world_size, rank=rank, shuffle=True)
+        epoch_steps = [math.ceil(len(dist_sampler) / args.batch_size)] * args.epochs
+        forward_model = DistributedDataParallel(model)
+        print(f"Data-parallel over {world_size} ranks, {torch.get_num_threads()} threads each")
+    if args.benchmark_steps:
+        epoch_steps = [min(n, args.benchmark_steps) for n in epoch_steps]
 
     train_dl = DataLoader(
         train_ds,
         batch_size=args.batch_size,
-        shuffle=True,
-        collate_fn=lambda b: collate_batch(b, pad_token_id=tokenizer.pad_token_id),
+        shuffle=not args.stream and sampler is None and dist_sampler is None,
+        sampler=sampler if sampler is not None else dist_sampler,
+        num_workers=args.num_workers,
+        collate_fn=partial(collate_fn, pad_token_id=tokenizer.pad_token_id),
     )
 
-    model = create_model(args.model_name)
-    model.to(args.device)
     # Create class weights to boost PII precision
     class_weights = torch.ones(len(LABELS))
     for i, label in enumerate(LABELS):
@@ -54,24 +214,70 @@ def main():
     
     model.train()
 
-    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
-    total_steps = len(train_dl) * args.epochs
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=args.lr)
+    total_steps = sum(epoch_steps)
     scheduler = get_linear_schedule_with_warmup(
         optimizer, num_warmup_steps=int(0.1 * total_steps), num_training_steps=total_steps
     )
 
+    total_tokens = 0
+    total_time = 0.0
+    examples_seen = 0
+    # Later epochs run only the upper layers on cached features
+    encoder_split = ExitStack()
+    if args.feature_cache:
+        encoder_split.enter_context(truncated_encoder(model, args.freeze_layers, "upper"))
     for epoch in range(args.epochs):
+        if args.stream:
+            train_ds.set_epoch(epoch)
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+        if dist_sampler is not None:
+            dist_sampler.set_epoch(epoch)
         running_loss = 0.0
-        for batch in tqdm(train_dl, desc=f"Epoch {epoch+1}/{args.epochs}"):
-            input_ids = torch.tensor(batch["input_ids"], device=args.device)
-            attention_mask = torch.tensor(batch["attention_mask"], device=args.device)
+        num_batches = 0
+        epoch_tokens = 0
+        epoch_start = time.perf_counter()
+        for batch in tqdm(train_dl, desc=f"Epoch {epoch+1}/{args.epochs}", total=epoch_steps[epoch], disable=rank > 0):
+            if args.benchmark_steps and num_batches >= args.benchmark_steps:
+                break
+            attention_mask = torch.as_tensor(batch["attention_mask"], device=args.device)
             labels = torch.tensor(batch["labels"], device=args.device)
-
-            outputs = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+            if "hidden_states" in batch:
+                outputs = forward_model(inputs_embeds=batch["hidden_states"].to(args.device), attention_mask=attention_mask)
+            else:
+                input_ids = torch.tensor(batch["input_ids"], device=args.device)
+                position_ids = None
+                if "position_ids" in batch:
+                    position_ids = torch.tensor(batch["position_ids"], device=args.device)
+                outputs = forward_model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids)
              # Apply class weights to loss
             logits = outputs.logits
-            loss_fct = torch.nn.CrossEntropyLoss(weight=class_weights, ignore_index=-100)
-            loss = loss_fct(logits.view(-1, len(LABELS)), labels.view(-1))
+            if world_size > 1:
+                # Normalise by the class-weight total over all ranks so the averaged gradient
+                # equals that of one weighted-mean loss over the combined batch
+                loss_sum = torch.nn.functional.cross_entropy(
+                    logits.view(-1, len(LABELS)), labels.view(-1),
+                    weight=class_weights, ignore_index=-100, reduction="sum",
+                )
+                targets = labels.view(-1)
+                totals = torch.stack([loss_sum.detach(), class_weights[targets[targets != -100]].sum()])
+                dist.all_reduce(totals)
+                loss = loss_sum * world_size / totals[1]
+                batch_loss = (totals[0] / totals[1]).item()
+            else:
+                loss_fct = torch.nn.CrossEntropyLoss(weight=class_weights, ignore_index=-100)
+                loss = loss_fct(logits.view(-1, len(LABELS)), labels.view(-1))
+                batch_loss = loss.item()
+            if sampler is not None:
+                with torch.no_grad():
+                    token_loss = torch.nn.functional.cross_entropy(
+                        logits.view(-1, len(LABELS)), labels.view(-1),
+                        weight=class_weights, ignore_index=-100, reduction="none",
+                    ).view(labels.shape)
+                    valid = (labels != -100).sum(dim=1).clamp(min=1)
+                    per_example = (token_loss.sum(dim=1) / valid).tolist()
+                sampler.update([id_to_index[uid] for uid in batch["ids"]], per_example)
 
             optimizer.zero_grad()
             loss.backward()
@@ -83,14 +289,132 @@ def main():
             optimizer.step()
             scheduler.step()
 
-            running_loss += loss.item()
+            running_loss += batch_loss
+            num_batches += 1
+            examples_seen += len(batch["ids"])
+            epoch_tokens += batch["num_tokens"]
+
+        epoch_time = time.perf_counter() - epoch_start
+        total_tokens += epoch_tokens
+        total_time += epoch_time
+        avg_loss = running_loss / max(1, num_batches)
+        print(
+            f"Epoch {epoch+1} average loss: {avg_loss:.4f} "
+            f"({epoch_tokens / max(epoch_time, 1e-9):.0f} tokens/sec)"
+        )
+    encoder_split.close()
 
-        avg_loss = running_loss / max(1, len(train_dl))
-        print(f"Epoch {epoch+1} average loss: {avg_loss:.4f}")
+    if world_size > 1:
+        counts = torch.tensor([examples_seen, total_tokens], dtype=torch.long)
+        dist.all_reduce(counts)
+        examples_seen, total_tokens = counts.tolist()
+    samples_per_sec = examples_seen / max(total_time, 1e-9)
+    if args.benchmark_steps:
+        return {"samples_per_sec": samples_per_sec}
+    print(f"Effective training throughput: {total_tokens / max(total_time, 1e-9):.0f} tokens/sec")
+    print(f"Training throughput: {samples_per_sec:.1f} samples/sec over {world_size} rank(s)")
+    if sampler is not None:
+        full = len(train_ds) * args.epochs
+        print(
+            f"Curriculum: {examples_seen} example forward/backward passes vs {full} for full-data epochs "
+            f"({full - examples_seen} saved, {100.0 * (full - examples_seen) / max(1, full):.1f}%)"
+        )
+    if full_step_time is not None:
+        full_estimate = full_step_time * total_steps
+        cached_total = cache_time + total_time
+        print(
+            f"Wall clock: {cached_total:.1f}s with feature cache ({cache_time:.1f}s caching) vs "
+            f"~{full_estimate:.1f}s estimated for full fine-tuning ({full_estimate / max(cached_total, 1e-9):.1f}x speedup)"
+        )
+    if rank > 0:
+        return None
+    metrics = None
+    if args.dev and os.path.exists(args.dev):
+        metrics = evaluate(model, tokenizer, args.dev, args.max_length, args.device)
+        metrics["tokens_per_sec"] = total_tokens / max(total_time, 1e-9)
+        print(f"Dev span Macro-F1: {metrics['macro_f1']:.3f}  PII-F1: {metrics['pii'][2]:.3f}")
 
     model.save_pretrained(args.out_dir)
     tokenizer.save_pretrained(args.out_dir)
     print(f"Saved model + tokenizer to {args.out_dir}")
+    return metrics
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rank_worker(rank, args, world_size, port, results):
+    torch.set_num_threads(args.threads_per_rank or max(1, (os.cpu_count() or 1) // world_size))
+    if rank > 0:
+        sys.stdout = open(os.devnull, "w")
+    if world_size > 1:
+        dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size)
+    try:
+        out = train(args, rank, world_size)
+    finally:
+        if world_size > 1:
+            dist.destroy_process_group()
+    if rank == 0:
+        results.put(out)
+
+
+def launch(args, world_size):
+    """Run train() in world_size local processes and return rank 0's result"""
+    results = mp.get_context("spawn").SimpleQueue()
+    mp.spawn(_rank_worker, args=(args, world_size, _free_port(), results), nprocs=world_size)
+    return results.get()
+
+
+def report_scaling(args):
+    """Time --benchmark_steps steps per rank at 1, 2, 4, ... --ranks ranks, splitting the cores evenly"""
+    bench = copy.copy(args)
+    bench.epochs = 1
+    bench.benchmark_steps = args.benchmark_steps or 20
+    sizes = sorted({2 ** i for i in range(int(math.log2(args.ranks)) + 1)} | {args.ranks})
+    rows = []
+    for world_size in sizes:
+        rows.append((world_size, launch(bench, world_size)["samples_per_sec"]))
+    cores = os.cpu_count() or 1
+    print(f"\n{'ranks':>5s} {'threads/rank':>12s} {'samples/sec':>12s} {'speedup':>8s} {'efficiency':>10s}")
+    for world_size, rate in rows:
+        speedup = rate / rows[0][1]
+        threads = args.threads_per_rank or max(1, cores // world_size)
+        print(f"{world_size:5d} {threads:12d} {rate:12.1f} {speedup:7.2f}x {100.0 * speedup / world_size:9.1f}%")
+
+
+def compare_packing(args):
+    """Train unpacked and packed into out_dir_unpacked / out_dir_packed and report the throughput gain and F1 delta"""
+    if not (args.dev and os.path.exists(args.dev)):
+        raise ValueError("--compare_packing needs a --dev file to score both runs")
+    results = {}
+    for name, pack in (("unpacked", False), ("packed", True)):
+        run = copy.copy(args)
+        run.pack = pack
+        run.out_dir = f"{args.out_dir.rstrip('/')}_{name}"
+        results[name] = train(run)
+    unpacked, packed = results["unpacked"], results["packed"]
+    print(f"\n{'mode':9s} {'tokens/sec':>11s} {'Macro-F1':>9s} {'PII-F1':>7s}")
+    for name, m in results.items():
+        print(f"{name:9s} {m['tokens_per_sec']:11.0f} {m['macro_f1']:9.3f} {m['pii'][2]:7.3f}")
+    print(
+        f"Packing: {packed['tokens_per_sec'] / max(unpacked['tokens_per_sec'], 1e-9):.2f}x tokens/sec, "
+        f"Macro-F1 {packed['macro_f1'] - unpacked['macro_f1']:+.3f}, PII-F1 {packed['pii'][2] - unpacked['pii'][2]:+.3f}"
+    )
+
+
+def main():
+    args = parse_args()
+    if args.compare_packing:
+        compare_packing(args)
+    elif args.scaling:
+        report_scaling(args)
+    elif args.ranks > 1:
+        launch(args, args.ranks)
+    else:
+        train(args)
 
 
 if __name__ == "__main__":